@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import cache
+import preprocessor
+
+# 1970-01-01, day 0 of the day numbers, was a Thursday
+EPOCH_WEEKDAY = 3
+
+
+class ActivityCube:
+    """Message counts per (user, day, hour) of a chat.
+
+    Built once per chat from integer codes: only the non-empty cells are kept,
+    sorted by user so one user's cells are a contiguous slice. The timelines,
+    activity maps and heatmap are roll-ups of a slice with np.bincount.
+    """
+
+    def __init__(self, df):
+        users = df['user']
+        if not isinstance(users.dtype, pd.CategoricalDtype):
+            users = users.astype('category')
+        self.users = list(users.cat.categories)
+        self.user_lookup = {user: user_id for user_id, user in enumerate(self.users)}
+
+        # Day and hour numbers straight from the timestamps, compact frames have no calendar columns
+        hours = df['date'].to_numpy().astype('datetime64[h]').view(np.int64)
+        days = hours // 24
+        self.first_day = int(days.min()) if len(days) else 0
+        self.n_days = int(days.max()) - self.first_day + 1 if len(days) else 0
+        key = ((users.cat.codes.to_numpy().astype(np.int64) * self.n_days + (days - self.first_day)) * 24
+               + hours % 24)
+        cells, counts = np.unique(key, return_counts=True)
+
+        self.hour = (cells % 24).astype(np.int8)
+        cells //= 24
+        self.day = (cells % max(self.n_days, 1)).astype(np.int32)
+        user_ids = cells // max(self.n_days, 1)
+        self.count = counts.astype(np.int64)
+        self.offsets = np.searchsorted(user_ids, np.arange(len(self.users) + 1))
+
+        # Calendar of every day of the span
+        calendar = pd.DatetimeIndex((self.first_day + np.arange(self.n_days)).astype('datetime64[D]'))
+        self.first_year = int(calendar.year[0]) if self.n_days else 0
+        self.day_month = calendar.month.to_numpy() - 1
+        # Months since January of the first year
+        self.day_months = (calendar.year.to_numpy() - self.first_year) * 12 + self.day_month
+        self.day_weekday = (self.first_day + np.arange(self.n_days) + EPOCH_WEEKDAY) % 7
+
+    def cells(self, selected_user):
+        """Returns (day, hour, count) of the cells of `selected_user`, or of everyone for 'Overall'."""
+        if selected_user == 'Overall':
+            return self.day, self.hour, self.count
+        user_id = self.user_lookup.get(selected_user)
+        if user_id is None:
+            return self.day[:0], self.hour[:0], self.count[:0]
+        cells = slice(self.offsets[user_id], self.offsets[user_id + 1])
+        return self.day[cells], self.hour[cells], self.count[cells]
+
+    def per_day(self, selected_user):
+        day, _, count = self.cells(selected_user)
+        return np.bincount(day, weights=count, minlength=self.n_days).astype(np.int64)
+
+    def monthly_timeline(self, selected_user):
+        per_day = self.per_day(selected_user)
+        per_month = np.bincount(self.day_months, weights=per_day).astype(np.int64)
+        active = np.flatnonzero(per_month)
+        year, month_num = self.first_year + active // 12, active % 12 + 1
+        month = [preprocessor.MONTHS[i - 1] for i in month_num]
+        # One row per active month, the labels are cheap to build in Python
+        return pd.DataFrame({'year': year, 'month_num': month_num, 'month': month, 'message': per_month[active],
+                             'time': [name + "-" + str(y) for name, y in zip(month, year)]})
+
+    def daily_timeline(self, selected_user):
+        per_day = self.per_day(selected_user)
+        active = np.flatnonzero(per_day)
+        dates = (self.first_day + active).astype('datetime64[D]').astype(object)
+        return pd.DataFrame({'only_date': dates, 'message': per_day[active]})
+
+    def _map(self, counts, labels, name):
+        # Non-empty labels, in calendar order
+        active = np.flatnonzero(counts)
+        index = pd.CategoricalIndex([labels[i] for i in active], categories=labels, ordered=True, name=name)
+        return pd.Series(counts[active], index=index, name='count')
+
+    def week_activity_map(self, selected_user):
+        counts = np.bincount(self.day_weekday, weights=self.per_day(selected_user), minlength=7).astype(np.int64)
+        return self._map(counts, preprocessor.DAYS, 'day_name')
+
+    def month_activity_map(self, selected_user):
+        counts = np.bincount(self.day_month, weights=self.per_day(selected_user), minlength=12).astype(np.int64)
+        return self._map(counts, preprocessor.MONTHS, 'month')
+
+    def activity_heatmap(self, selected_user):
+        day, hour, count = self.cells(selected_user)
+        if len(count) == 0:
+            return pd.DataFrame()
+        cells = self.day_weekday[day] * 24 + hour
+        heatmap = np.bincount(cells, weights=count, minlength=7 * 24).astype(np.int64).reshape(7, 24)
+        days = np.flatnonzero(heatmap.any(axis=1))
+        hours = np.flatnonzero(heatmap.any(axis=0))
+        return pd.DataFrame(heatmap[np.ix_(days, hours)],
+                            index=pd.CategoricalIndex([preprocessor.DAYS[i] for i in days],
+                                                      categories=preprocessor.DAYS, ordered=True, name='day_name'),
+                            columns=pd.CategoricalIndex([preprocessor.PERIODS[i] for i in hours],
+                                                        categories=preprocessor.PERIODS, name='period'))
+
+
+def get_activity(df):
+    """Returns the ActivityCube of `df`, building it on first use."""
+    return cache.per_chat(df, 'activity', ActivityCube)
@@ -1,11 +1,10 @@
+import os
+import json
 import streamlit as st
-import preprocessor, helper
-import matplotlib.pyplot as plt
-import seaborn as sns
+import preprocessor, helper, cache, chat_index, profiling, scheduler, charts, archive
 import numpy as np
 import pandas as pd
 from collections import Counter
-import plotly.express as px
 
 # Set page configuration for a professional look
 st.set_page_config(
@@ -151,6 +150,341 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# One parse cache shared by every session of this server
+@st.cache_resource
+def get_parse_cache():
+    max_mb = int(os.environ.get('CHAT_CACHE_MAX_MB', 1024))
+    max_disk_mb = int(os.environ.get('CHAT_CACHE_DIR_MAX_MB', 4096))
+    return cache.ParseCache(max_bytes=max_mb * 1024 ** 2, disk_dir=os.environ.get('CHAT_CACHE_DIR'),
+                            max_disk_bytes=max_disk_mb * 1024 ** 2)
+
+def show_chart(fig, **kwargs):
+    # `fig` is a plotly figure or its JSON from charts.figure_json. Rendering is timed
+    # apart from the analyses in the Performance panel, with the size of the figure JSON
+    payload = None
+    if isinstance(fig, str):
+        payload, fig = fig, json.loads(fig)
+        title = fig['layout'].get('title', {}).get('text')
+    else:
+        title = fig.layout.title.text
+        if profiling.enabled():
+            payload = fig.to_json()
+    with profiling.span('render ' + (title or 'chart')):
+        if payload is not None:
+            profiling.note_payload(len(payload.encode('utf-8')))
+        st.plotly_chart(fig, **kwargs)
+
+# Rows of the emoji table sent to the browser
+EMOJI_ROWS = 100
+
+# Dashboard sections, each drawn from the results of its analyses once they are all ready
+def render_stats(selected_user, results):
+    (num_messages, total_words, num_media_messages, num_links), media_df = results
+    st.header("✨ Top Statistics")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric(label="Total Messages", value=f"{num_messages:,}")
+    with col2:
+        st.metric(label="Total Words", value=f"{total_words:,}")
+    with col3:
+        st.metric(label="Media Shared", value=f"{num_media_messages:,}")
+    with col4:
+        st.metric(label="Links Shared", value=f"{num_links:,}")
+
+    # Zip exports only: the media shared by type, with their size in the archive
+    if not media_df.empty:
+        st.subheader("📎 Media Shared by Type")
+        media_df = media_df.assign(MB=(media_df['bytes'] / 1024 ** 2).round(2)).drop(columns='bytes')
+        st.dataframe(media_df, use_container_width=True)
+
+def render_timeline(selected_user, results):
+    timeline_df, daily_timeline_df = results
+    st.header("📈 Monthly Activity")
+
+    # Long timelines are downsampled and drawn with WebGL, see charts.line
+    def monthly_chart():
+        fig = charts.line(timeline_df, 
+                          x='time', 
+                          y='message', 
+                          title='Monthly Activity Timeline',
+                          labels={'message': 'Number of Messages', 'time': 'Month-Year'},
+                          template='plotly_dark')
+        
+        fig.update_layout(
+            xaxis_title_font_color='white',
+            yaxis_title_font_color='white',
+            title_font_color='white',
+            xaxis_tickangle=-45
+        )
+        return fig
+    show_chart(charts.figure_json(df, selected_user, 'monthly', monthly_chart), use_container_width=True)
+
+    # Daily Timeline
+    st.header("📅 Daily Activity")
+
+    def daily_chart():
+        fig = charts.line(daily_timeline_df, 
+                          x='only_date', 
+                          y='message', 
+                          title='Daily Activity Timeline',
+                          labels={'message': 'Number of Messages', 'only_date': 'Date'},
+                          template='plotly_dark')
+
+        fig.update_layout(
+            xaxis_title_font_color='white',
+            yaxis_title_font_color='white',
+            title_font_color='white',
+            xaxis_tickangle=-45
+        )
+        return fig
+    show_chart(charts.figure_json(df, selected_user, 'daily', daily_chart), use_container_width=True)
+
+def render_activity(selected_user, results):
+    busy_day, busy_month, user_heatmap = results
+    st.header("🗓️ Activity Maps")
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.subheader("Most Busy Day")
+        fig = px.bar(busy_day,
+                     x=busy_day.index,
+                     y=busy_day.values,
+                     title='Most Busy Day',
+                     labels={'x': 'Day of Week', 'y': 'Number of Messages'},
+                     template='plotly_dark',
+                     color_discrete_sequence=['#FF4500'])
+        fig.update_layout(
+            xaxis_title_font_color='white',
+            yaxis_title_font_color='white',
+            title_font_color='white',
+            xaxis_tickangle=-45
+        )
+        show_chart(fig, use_container_width=True)
+    with col2:
+        st.subheader("Most Busy Month")
+        fig = px.bar(busy_month,
+                     x=busy_month.index,
+                     y=busy_month.values,
+                     title='Most Busy Month',
+                     labels={'x': 'Month', 'y': 'Number of Messages'},
+                     template='plotly_dark',
+                     color_discrete_sequence=['#8A2BE2'])
+        fig.update_layout(
+            xaxis_title_font_color='white',
+            yaxis_title_font_color='white',
+            title_font_color='white',
+            xaxis_tickangle=-45
+        )
+        show_chart(fig, use_container_width=True)
+
+    st.subheader("Weekly Activity Heatmap")
+
+    def heatmap_chart():
+        fig = px.imshow(user_heatmap,
+                        title="Weekly Activity Heatmap",
+                        labels=dict(x="Hour of Day", y="Day of Week", color="Message Count"),
+                        color_continuous_scale='YlGnBu')
+        fig.update_layout(
+            xaxis_title_font_color='white',
+            yaxis_title_font_color='white',
+            title_font_color='white'
+        )
+        return fig
+    show_chart(charts.figure_json(df, selected_user, 'heatmap', heatmap_chart), use_container_width=True)
+
+def render_users(selected_user, results):
+    x, new_df = results[0]
+    st.header("👥 Most Busy Users")
+    col1, col2 = st.columns(2)
+    with col1:
+        fig = px.bar(x,
+                     x=x.index,
+                     y=x.values,
+                     title='Most Busy Users',
+                     labels={'x': 'User', 'y': 'Number of Messages'},
+                     template='plotly_dark',
+                     color_discrete_sequence=['#00CED1'])
+        fig.update_layout(
+            xaxis_title_font_color='white',
+            yaxis_title_font_color='white',
+            title_font_color='white',
+            xaxis_tickangle=-45
+        )
+        show_chart(fig, use_container_width=True)
+    with col2:
+        st.dataframe(new_df)
+
+def render_words(selected_user, results):
+    df_wc, most_common_df = results
+    st.header("☁️ Word Cloud")
+    fig, ax = plt.subplots(figsize=(10, 10))
+    ax.imshow(df_wc)
+    ax.axis("off")
+    fig.patch.set_facecolor('#121820')
+    with profiling.span('render word cloud'):
+        st.pyplot(fig)
+
+    st.header("📝 Most Common Words")
+    fig = px.bar(most_common_df,
+                 x='Count', # Corrected from x=most_common_df[1]
+                 y='Word',  # Corrected from y=most_common_df[0]
+                 orientation='h',
+                 title='Most Common Words',
+                 labels={'Count': 'Count', 'Word': 'Words'},
+                 template='plotly_dark',
+                 color_discrete_sequence=['#FF6347'])
+    fig.update_layout(
+        xaxis_title_font_color='white',
+        yaxis_title_font_color='white',
+        title_font_color='white'
+    )
+    show_chart(fig, use_container_width=True)
+
+def render_emojis(selected_user, results):
+    emoji_df = results[0]
+    st.header("😂 Emoji Analysis")
+
+    if not emoji_df.empty:
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.dataframe(emoji_df.head(EMOJI_ROWS))
+            if len(emoji_df) > EMOJI_ROWS:
+                st.caption(f"Top {EMOJI_ROWS} of {len(emoji_df)} emojis")
+        
+        with col2:
+            fig = px.pie(emoji_df.head(5),
+                         names='emoji',
+                         values='count',
+                         title='Top 5 Emojis Used',
+                         template='plotly_dark',
+                         hole=0.4,
+                         color_discrete_sequence=px.colors.sequential.RdBu)
+            fig.update_traces(textposition='inside', textinfo='percent+label')
+            fig.update_layout(showlegend=False)
+            show_chart(fig)
+    else:
+        st.info("No emojis found for this user/chat.")
+
+def render_sentiment(selected_user, results):
+    sentiment_df = results[0]
+    st.subheader("Sentiment Analysis 😃🙁")
+    if not sentiment_df.empty:
+        sentiment_counts = sentiment_df['sentiment'].value_counts().reset_index()
+        sentiment_counts.columns = ['Sentiment', 'Count']
+
+        fig = px.pie(sentiment_counts, 
+                     names='Sentiment', 
+                     values='Count', 
+                     title='Sentiment Distribution',
+                     template='plotly_dark',
+                     hole=0.4,
+                     color='Sentiment',
+                     color_discrete_map={
+                        'Positive': '#7FFF7F',  
+                        'Neutral': '#6495ED',   
+                        'Negative': '#FF6347'
+                    })
+        fig.update_traces(textposition='inside', textinfo='percent+label')
+        fig.update_layout(showlegend=False)
+        show_chart(fig)
+    else:
+        st.info("Not enough message data for sentiment analysis.")
+
+def render_response(selected_user, results):
+    response_df, avg_response_by_user = results[0]
+    st.subheader("Response Time Analysis ⏱️")
+    if not response_df.empty:
+        if selected_user == 'Overall':
+            st.write("Response time per user (in minutes):")
+        else:
+            st.write(f"Response time of {selected_user} to each user (in minutes):")
+        st.dataframe(avg_response_by_user.round(2))
+
+        # Binned here: a histogram trace would send every response time to the browser
+        def response_chart():
+            fig = charts.histogram(response_df['response_time_minutes'],
+                                   nbins=50,
+                                   log_y=True,
+                                   title='Response Time Distribution',
+                                   labels={'x': 'Response Time (min)', 'y': 'count'},
+                                   template='plotly_dark')
+            fig.update_layout(
+                xaxis_title_font_color='white',
+                yaxis_title_font_color='white',
+                title_font_color='white'
+            )
+            return fig
+        show_chart(charts.figure_json(df, selected_user, ('response', session_gap_minutes), response_chart),
+                   use_container_width=True)
+    else:
+        st.info("Not enough data to analyze response times.")
+
+def render_style(selected_user, results):
+    temp_df, length_stats = results[0]
+    st.subheader("Communication Style ✍️")
+    if not temp_df.empty:
+        st.write("Average message length and word count:")
+        st.dataframe(length_stats)
+
+def render_topics(selected_user, results):
+    topics_list, lda_model = results[0]
+    st.subheader("Top Conversation Topics 💬")
+    if topics_list:
+        for topic in topics_list:
+            st.write(f"**Topic {topic['topic_id']}:** {', '.join(topic['words'])}")
+        if len(results) > 1:
+            st.write("How the topics drift over time:")
+            drift_df = results[1].copy()
+            drift_df['words'] = drift_df['words'].str.join(', ')
+            st.dataframe(drift_df, use_container_width=True)
+    else:
+        st.info("Not enough messages to perform topic modeling (min 10 messages).")
+
+def render_search(selected_user, query, start, end, results):
+    hits, messages, timeline_df = results
+    st.header("🔎 Search")
+    st.metric("Matching Messages", hits)
+    if not hits:
+        st.info(f"No message matches {query!r}.")
+        return
+
+    # Same chart as the monthly timeline, counting the matching messages
+    def search_chart():
+        fig = charts.line(timeline_df,
+                          x='time',
+                          y='message',
+                          title=f'Messages matching {query!r}',
+                          labels={'message': 'Matching Messages', 'time': 'Month-Year'},
+                          template='plotly_dark')
+
+        fig.update_layout(
+            xaxis_title_font_color='white',
+            yaxis_title_font_color='white',
+            title_font_color='white',
+            xaxis_tickangle=-45
+        )
+        return fig
+    show_chart(charts.figure_json(df, selected_user, ('search', query, start, end), search_chart),
+               use_container_width=True)
+    st.write(f"Latest {len(messages)} matches:")
+    st.dataframe(messages, use_container_width=True)
+
+# Section names with their title and renderer, in dashboard order
+SECTIONS = {
+    'stats': ("Top Statistics", render_stats),
+    'timeline': ("Activity Timelines", render_timeline),
+    'activity': ("Activity Maps", render_activity),
+    'users': ("Most Busy Users", render_users),
+    'words': ("Word Cloud and Most Common Words", render_words),
+    'emojis': ("Emoji Analysis", render_emojis),
+    'sentiment': ("Sentiment Analysis", render_sentiment),
+    'response': ("Response Time Analysis", render_response),
+    'style': ("Communication Style", render_style),
+    'topics': ("Topics", render_topics),
+}
+ADVANCED_SECTIONS = ('sentiment', 'response', 'style', 'topics')
+
 # Main title for the landing page
 st.title("WhatsApp Chat Analyzer 💬")
 st.markdown("Transform your conversations into actionable insights with advanced analytics and AI-powered features.")
@@ -160,7 +494,16 @@ st.markdown("---")
 st.sidebar.title("💬 WhatsApp Chat Analyzer")
 st.sidebar.markdown("---")
 st.sidebar.header("Upload your exported file")
-uploaded_file = st.sidebar.file_uploader("Choose a file")
+uploaded_file = st.sidebar.file_uploader("Choose a file (.txt, or .zip exported with media)")
+
+# Instrumentation costs next to nothing while the panel is off. Only the calls of this
+# session's rerun are recorded, other sessions are not affected
+performance = st.sidebar.checkbox("Performance panel", value=False, key="performance")
+if st.session_state.get('profiling_run'):
+    # A rerun interrupted before the end of the script leaves its run open
+    profiling.end_run(st.session_state.pop('profiling_run'))
+perf_run = profiling.start_run() if performance else None
+st.session_state['profiling_run'] = perf_run
 
 # Conditional logic to show either the landing page or the dashboard
 if uploaded_file is None:
@@ -204,14 +547,25 @@ if uploaded_file is None:
 
 else:
     # --- Analysis Options in Sidebar ---
-    bytes_data = uploaded_file.getvalue()
-    data = bytes_data.decode("utf-8")
-    df = preprocessor.preprocess(data)
-
-    user_list = df['user'].unique().tolist()
-    if 'group_notification' in user_list:
-        user_list.remove('group_notification')
-    user_list.sort()
+    # Reruns and re-uploads of a known export are served from the parse cache
+    parse_cache = get_parse_cache()
+    # Smaller frames for large chats: Arrow strings and calendar columns derived on demand, see preprocessor.compact
+    compact_layout = st.sidebar.checkbox("Compact in-memory layout", value=os.environ.get('CHAT_COMPACT') == '1',
+                                         key="compact_layout")
+    with profiling.span('app.parse_upload'):
+        data = uploaded_file.getvalue()
+        # "Include media" exports are parsed without extracting the archive, see archive.py
+        parse = archive.parse_zip if archive.is_zip(data) else preprocessor.preprocess
+        if compact_layout:
+            df = parse_cache.get(data, parse=lambda data: parse(data, compact_layout=True), variant='compact')
+        else:
+            df = parse_cache.get(data, parse=parse)
+        del data
+    cache_stats = parse_cache.stats()
+    st.sidebar.caption(f"Parse cache: {cache_stats['hits'] + cache_stats['disk_hits']} hits, "
+                       f"{cache_stats['misses']} misses")
+
+    user_list = chat_index.get_index(df).users()
     user_list.insert(0, "Overall")
 
     selected_user = st.sidebar.selectbox("Show analysis for:", user_list)
@@ -233,6 +587,9 @@ else:
         emojis = st.checkbox("Emojis", value=select_all, key="emojis")
     with col2:
         words = st.checkbox("Words", value=select_all, key="words")
+        if words:
+            # The preview is drawn at half the size, in a fraction of the time
+            wordcloud_full = st.checkbox("Full size word cloud", value=False, key="wordcloud_full")
         activity = st.checkbox("Activity", value=select_all, key="activity")
         users = st.checkbox("Users", value=select_all, key="users")
     
@@ -240,256 +597,138 @@ else:
     col3, col4 = st.sidebar.columns(2)
     with col3:
         sentiment = st.checkbox("Sentiment", value=False, key="sentiment")
+        if sentiment:
+            sentiment_backend = st.selectbox("Sentiment engine", ['textblob', 'vader'],
+                                             format_func=lambda name: {'textblob': 'TextBlob',
+                                                                       'vader': 'VADER (fast)'}[name],
+                                             key="sentiment_backend")
         response = st.checkbox("Response", value=False, key="response")
+        if response:
+            # Replies after a longer silence start a new conversation and are not counted
+            session_gap_hours = st.number_input("Conversation gap (hours, 0 = none)", min_value=0, value=0,
+                                                key="session_gap")
+            session_gap_minutes = session_gap_hours * 60 if session_gap_hours else None
         style = st.checkbox("Style", value=False, key="style")
         topics = st.checkbox("Topics", value=False, key="topics")
+        if topics:
+            n_topics = st.number_input("Number of topics", min_value=2, max_value=20, value=5, key="n_topics")
+            topic_method = st.selectbox("Topic model", ['lda', 'nmf'],
+                                        format_func=lambda name: {'lda': 'LDA', 'nmf': 'NMF (fast)'}[name],
+                                        key="topic_method")
+            topic_window = st.selectbox("Topics over time", [None, 'M', 'Q', 'Y'],
+                                        format_func=lambda window: {None: 'Off', 'M': 'Monthly', 'Q': 'Quarterly',
+                                                                    'Y': 'Yearly'}[window],
+                                        key="topic_window")
     
+    # Full-text search, answered from an inverted index built once per chat (see search.py)
+    st.sidebar.subheader("Search")
+    search_query = st.sidebar.text_input("Words or \"phrases\"", key="search_query")
+    if search_query:
+        first_date, last_date = df['date'].min().date(), df['date'].max().date()
+        search_dates = st.sidebar.date_input("Between", value=(first_date, last_date), min_value=first_date,
+                                             max_value=last_date, key="search_dates")
+
     # Placeholder for the new and upcoming features
     st.sidebar.subheader("Upcoming Features")
     st.sidebar.markdown("`Dynamics` `AI Insights` `Predictions` `Report` `Anonymous Mode`")
 
     if st.sidebar.button("Run Analysis"):
+        # Chart libraries are only loaded once there is something to draw
+        import matplotlib.pyplot as plt
+        import plotly.express as px
+
         st.title("📊 Chat Analysis Dashboard")
 
-        # Top Statistics with colorful icons
+        # Every selected analysis runs concurrently, CPU-bound ones in worker processes
+        analyses = scheduler.AnalysisScheduler(df)
         if basic_stats:
-            st.header("✨ Top Statistics")
-            num_messages, total_words, num_media_messages, num_links = helper.fetch_stats(selected_user, df)
-            
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.metric(label="Total Messages", value=f"{num_messages:,}")
-            with col2:
-                st.metric(label="Total Words", value=f"{total_words:,}")
-            with col3:
-                st.metric(label="Media Shared", value=f"{num_media_messages:,}")
-            with col4:
-                st.metric(label="Links Shared", value=f"{num_links:,}")
-
-        # Monthly Timeline
+            analyses.add('stats', 'fetch_stats', selected_user)
+            analyses.add('stats', 'media_breakdown', selected_user)
         if timeline:
-            st.header("📈 Monthly Activity")
-            timeline_df = helper.monthly_timeline(selected_user, df)
-            
-            fig = px.line(timeline_df, 
-                          x='time', 
-                          y='message', 
-                          title='Monthly Activity Timeline',
-                          labels={'message': 'Number of Messages', 'time': 'Month-Year'},
-                          template='plotly_dark')
-            
-            fig.update_layout(
-                xaxis_title_font_color='white',
-                yaxis_title_font_color='white',
-                title_font_color='white',
-                xaxis_tickangle=-45
-            )
-            st.plotly_chart(fig, use_container_width=True)
-
-            # Daily Timeline
-            st.header("📅 Daily Activity")
-            daily_timeline_df = helper.daily_timeline(selected_user, df)
-            
-            fig = px.line(daily_timeline_df, 
-                          x='only_date', 
-                          y='message', 
-                          title='Daily Activity Timeline',
-                          labels={'message': 'Number of Messages', 'only_date': 'Date'},
-                          template='plotly_dark')
-
-            fig.update_layout(
-                xaxis_title_font_color='white',
-                yaxis_title_font_color='white',
-                title_font_color='white',
-                xaxis_tickangle=-45
-            )
-            st.plotly_chart(fig, use_container_width=True)
-        
-        # Activity Map
+            analyses.add('timeline', 'monthly_timeline', selected_user)
+            analyses.add('timeline', 'daily_timeline', selected_user)
         if activity:
-            st.header("🗓️ Activity Maps")
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.subheader("Most Busy Day")
-                busy_day = helper.week_activity_map(selected_user, df)
-                fig = px.bar(busy_day,
-                             x=busy_day.index,
-                             y=busy_day.values,
-                             title='Most Busy Day',
-                             labels={'x': 'Day of Week', 'y': 'Number of Messages'},
-                             template='plotly_dark',
-                             color_discrete_sequence=['#FF4500'])
-                fig.update_layout(
-                    xaxis_title_font_color='white',
-                    yaxis_title_font_color='white',
-                    title_font_color='white',
-                    xaxis_tickangle=-45
-                )
-                st.plotly_chart(fig, use_container_width=True)
-            with col2:
-                st.subheader("Most Busy Month")
-                busy_month = helper.month_activity_map(selected_user, df)
-                fig = px.bar(busy_month,
-                             x=busy_month.index,
-                             y=busy_month.values,
-                             title='Most Busy Month',
-                             labels={'x': 'Month', 'y': 'Number of Messages'},
-                             template='plotly_dark',
-                             color_discrete_sequence=['#8A2BE2'])
-                fig.update_layout(
-                    xaxis_title_font_color='white',
-                    yaxis_title_font_color='white',
-                    title_font_color='white',
-                    xaxis_tickangle=-45
-                )
-                st.plotly_chart(fig, use_container_width=True)
-
-            st.subheader("Weekly Activity Heatmap")
-            user_heatmap = helper.activity_heatmap(selected_user, df)
-            fig = px.imshow(user_heatmap,
-                            title="Weekly Activity Heatmap",
-                            labels=dict(x="Hour of Day", y="Day of Week", color="Message Count"),
-                            color_continuous_scale='YlGnBu')
-            fig.update_layout(
-                xaxis_title_font_color='white',
-                yaxis_title_font_color='white',
-                title_font_color='white'
-            )
-            st.plotly_chart(fig, use_container_width=True)
-
+            analyses.add('activity', 'week_activity_map', selected_user)
+            analyses.add('activity', 'month_activity_map', selected_user)
+            analyses.add('activity', 'activity_heatmap', selected_user)
         # Most busy users (Group level)
-        if users:
-            if selected_user == 'Overall':
-                st.header("👥 Most Busy Users")
-                x, new_df = helper.most_busy_users(df)
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    fig = px.bar(x,
-                                 x=x.index,
-                                 y=x.values,
-                                 title='Most Busy Users',
-                                 labels={'x': 'User', 'y': 'Number of Messages'},
-                                 template='plotly_dark',
-                                 color_discrete_sequence=['#00CED1'])
-                    fig.update_layout(
-                        xaxis_title_font_color='white',
-                        yaxis_title_font_color='white',
-                        title_font_color='white',
-                        xaxis_tickangle=-45
-                    )
-                    st.plotly_chart(fig, use_container_width=True)
-                with col2:
-                    st.dataframe(new_df)
-
-        # WordCloud and Most Common Words
+        if users and selected_user == 'Overall':
+            analyses.add('users', 'most_busy_users')
         if words:
-            st.header("☁️ Word Cloud")
-            df_wc = helper.create_wordcloud(selected_user, df)
-            
-            fig, ax = plt.subplots(figsize=(10, 10))
-            ax.imshow(df_wc)
-            ax.axis("off")
-            fig.patch.set_facecolor('#121820')
-            st.pyplot(fig)
-
-            st.header("📝 Most Common Words")
-            most_common_df = helper.most_common_words(selected_user, df)
-            
-            fig = px.bar(most_common_df,
-                         x='Count', # Corrected from x=most_common_df[1]
-                         y='Word',  # Corrected from y=most_common_df[0]
-                         orientation='h',
-                         title='Most Common Words',
-                         labels={'Count': 'Count', 'Word': 'Words'},
-                         template='plotly_dark',
-                         color_discrete_sequence=['#FF6347'])
-            fig.update_layout(
-                xaxis_title_font_color='white',
-                yaxis_title_font_color='white',
-                title_font_color='white'
-            )
-            st.plotly_chart(fig, use_container_width=True)
-
-        # Emoji analysis
+            analyses.add('words', 'create_wordcloud', selected_user, preview=not wordcloud_full, process=True)
+            analyses.add('words', 'most_common_words', selected_user)
         if emojis:
-            emoji_df = helper.emoji_helper(selected_user, df)
-            st.header("😂 Emoji Analysis")
+            analyses.add('emojis', 'emoji_helper', selected_user)
+        if sentiment:
+            # Scored in its own (spawned) process pool already, see sentiment.score_texts
+            analyses.add('sentiment', 'sentiment_analysis', selected_user, sentiment_backend)
+        if response:
+            analyses.add('response', 'response_time_analysis', selected_user, session_gap_minutes)
+        if style:
+            analyses.add('style', 'message_length_analysis', selected_user)
+        if topics:
+            analyses.add('topics', 'topic_modeling', selected_user, int(n_topics), method=topic_method, process=True)
+            if topic_window:
+                analyses.add('topics', 'topic_drift', selected_user, topic_window, int(n_topics), topic_method,
+                             process=True)
 
-            if not emoji_df.empty:
+        # One placeholder per section, in dashboard order, filled as soon as its results are ready
+        placeholders = {}
+        for section in SECTIONS:
+            if section == ADVANCED_SECTIONS[0]:
+                st.markdown("---")
+                st.header("🧠 Advanced Chat Insights")
+            if section in analyses.sections:
+                placeholders[section] = st.empty()
+                placeholders[section].info(f"⏳ {SECTIONS[section][0]}...")
+        progress = st.progress(0.0)
+
+        analyses.start()
+        for section, results, error in analyses.as_ready():
+            with placeholders[section].container():
+                if isinstance(error, LookupError):
+                    # Missing NLTK data is reported, never downloaded
+                    st.error(str(error))
+                elif error is not None:
+                    st.error(f"{SECTIONS[section][0]} failed: {error}")
+                else:
+                    SECTIONS[section][1](selected_user, results)
+            done, total = analyses.progress()
+            progress.progress(done / total, text=f"{done} of {total} analyses done")
+        progress.empty()
+
+        # Time, memory and cache use of every step of this run
+        if performance:
+            st.markdown("---")
+            st.header("⏱️ Performance")
+            perf_df = pd.DataFrame(profiling.summary(perf_run))
+            if not perf_df.empty:
+                perf_df['max_peak_memory_mb'] = perf_df.pop('max_peak_memory_bytes') / 1024 ** 2
+                st.dataframe(perf_df.round(3), use_container_width=True)
+                # Calls made in worker processes are not recorded above, only their task time
+                st.write("Analysis tasks:")
+                st.dataframe(pd.DataFrame([{'section': section, 'analysis': task.name,
+                                            'runs in': 'process' if task.process and analyses.processes else 'thread',
+                                            'seconds': task.seconds}
+                                           for section, tasks in analyses.sections.items() for task in tasks]).round(3),
+                             use_container_width=True)
+                st.caption("Times include the calls of other sessions running at the same time. "
+                           "Peak memory is traced with tracemalloc while the panel is on.")
                 col1, col2 = st.columns(2)
-                
                 with col1:
-                    st.dataframe(emoji_df)
-                
+                    st.download_button("Download JSON", profiling.to_json(run=perf_run), file_name="performance.json",
+                                       mime="application/json")
                 with col2:
-                    fig = px.pie(emoji_df.head(5),
-                                 names='emoji',
-                                 values='count',
-                                 title='Top 5 Emojis Used',
-                                 template='plotly_dark',
-                                 hole=0.4,
-                                 color_discrete_sequence=px.colors.sequential.RdBu)
-                    fig.update_traces(textposition='inside', textinfo='percent+label')
-                    fig.update_layout(showlegend=False)
-                    st.plotly_chart(fig)
-            else:
-                st.info("No emojis found for this user/chat.")
+                    st.download_button("Download Prometheus metrics", profiling.to_prometheus(run=perf_run),
+                                       file_name="performance.prom", mime="text/plain")
 
+    if search_query:
+        # A range is only complete once both dates are picked, the end day is included
+        search_start, search_end = (search_dates[0], search_dates[1] + pd.Timedelta(days=1)) \
+            if len(search_dates) == 2 else (None, None)
         st.markdown("---")
-        st.header("🧠 Advanced Chat Insights")
+        render_search(selected_user, search_query, search_start, search_end,
+                      helper.search_messages(selected_user, df, search_query, search_start, search_end))
 
-        # 1. Sentiment Analysis
-        if sentiment:
-            st.subheader("Sentiment Analysis 😃🙁")
-            sentiment_df = helper.sentiment_analysis(selected_user, df)
-            sentiment_counts = sentiment_df['sentiment'].value_counts().reset_index()
-            sentiment_counts.columns = ['Sentiment', 'Count']
-            
-            if not sentiment_counts.empty:
-                fig = px.pie(sentiment_counts, 
-                             names='Sentiment', 
-                             values='Count', 
-                             title='Sentiment Distribution',
-                             template='plotly_dark',
-                             hole=0.4,
-                             color='Sentiment',
-                             color_discrete_map={
-                                'Positive': '#7FFF7F',  
-                                'Neutral': '#6495ED',   
-                                'Negative': '#FF6347'
-                            })
-                fig.update_traces(textposition='inside', textinfo='percent+label')
-                fig.update_layout(showlegend=False)
-                st.plotly_chart(fig)
-            else:
-                st.info("Not enough message data for sentiment analysis.")
-
-        # 2. Response Time Analysis
-        if response:
-            st.subheader("Response Time Analysis ⏱️")
-            response_df, avg_response_by_user = helper.response_time_analysis(selected_user, df)
-            if not response_df.empty:
-                st.write("Average response time (in minutes):")
-                st.dataframe(avg_response_by_user.round(2))
-            else:
-                st.info("Not enough data to analyze response times.")
-
-        # 3. Message Length & Style Analysis
-        if style:
-            st.subheader("Communication Style ✍️")
-            temp_df, length_stats = helper.message_length_analysis(selected_user, df)
-            if not temp_df.empty:
-                st.write("Average message length and word count:")
-                st.dataframe(length_stats)
-
-        # 4. Topic Modeling
-        if topics:
-            st.subheader("Top Conversation Topics 💬")
-            topics_list, lda_model = helper.topic_modeling(selected_user, df)
-            if topics_list:
-                for topic in topics_list:
-                    st.write(f"**Topic {topic['topic_id']}:** {', '.join(topic['words'])}")
-            else:
-                st.info("Not enough messages to perform topic modeling (min 10 messages).")
\ No newline at end of file
+if perf_run is not None:
+    profiling.end_run(st.session_state.pop('profiling_run'))
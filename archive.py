@@ -0,0 +1,109 @@
+"""Exports made with "Include media": a .zip holding the chat .txt and its attachments.
+
+Nothing is extracted. The chat member is decompressed as a stream straight into
+the parser, and the media sizes and types come from the zip central directory,
+so the attachments are never read and memory does not grow with the archive.
+
+Usage: python archive.py EXPORT.zip
+"""
+import io
+import os
+import sys
+import zipfile
+import numpy as np
+import pandas as pd
+import preprocessor
+
+# Media type of an attachment by file extension
+MEDIA_TYPES = {
+    'image': ('.jpg', '.jpeg', '.png', '.gif', '.heic', '.bmp'),
+    'video': ('.mp4', '.3gp', '.mov', '.mkv', '.avi'),
+    'audio': ('.opus', '.ogg', '.mp3', '.m4a', '.aac', '.amr', '.wav'),
+    'sticker': ('.webp',),
+    'document': ('.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.txt', '.csv', '.zip', '.apk',
+                 '.vcf'),
+}
+_TYPE_BY_EXTENSION = {extension: media_type for media_type, extensions in MEDIA_TYPES.items()
+                      for extension in extensions}
+
+
+def is_zip(data):
+    """Tells whether uploaded bytes are a zip archive."""
+    return bytes(data[:4]) == b'PK\x03\x04'
+
+
+def media_type(name):
+    return _TYPE_BY_EXTENSION.get(os.path.splitext(name)[1].lower(), 'other')
+
+
+def chat_member(archive):
+    """Returns the name of the chat text in `archive`: '_chat.txt' (iOS) or 'WhatsApp Chat with ....txt'."""
+    texts = [info for info in archive.infolist() if not info.is_dir() and info.filename.lower().endswith('.txt')]
+    if not texts:
+        raise ValueError("No chat .txt file in the archive")
+    for info in texts:
+        name = os.path.basename(info.filename)
+        if name == '_chat.txt' or name.startswith('WhatsApp Chat'):
+            return info.filename
+    # Attached documents can be .txt files too, the chat is the largest one
+    return max(texts, key=lambda info: info.file_size).filename
+
+
+def media_files(archive, chat=None):
+    """Returns name, type, bytes and compressed_bytes of every attachment, read from the central directory."""
+    infos = [info for info in archive.infolist() if not info.is_dir() and info.filename != chat]
+    names = [os.path.basename(info.filename) for info in infos]
+    return pd.DataFrame({'name': names, 'type': [media_type(name) for name in names],
+                         'bytes': np.array([info.file_size for info in infos], dtype=np.int64),
+                         'compressed_bytes': np.array([info.compress_size for info in infos], dtype=np.int64)})
+
+
+def add_media_columns(df, files):
+    """Marks the messages attaching a file of the archive as media, with their `media_type` and `media_bytes`.
+
+    A message only counts as an attachment when the archive holds the file it
+    names, any other text stays a text message. Omitted media get the type 'omitted'.
+    """
+    names = preprocessor.attachment_names(df['message'])
+    sizes = dict(zip(files['name'], files['bytes']))
+    attached = names.isin(sizes.keys()).to_numpy()
+
+    types = np.full(len(df), None, dtype=object)
+    sizes_column = np.zeros(len(df), dtype=np.int64)
+    types[df['is_media'].to_numpy(dtype=bool)] = 'omitted'
+    attached_names = names[attached].to_numpy(dtype=object)
+    types[attached] = [media_type(name) for name in attached_names]
+    sizes_column[attached] = [sizes[name] for name in attached_names]
+    df['is_media'] = df['is_media'].to_numpy(dtype=bool) | attached
+    df['media_type'] = pd.Categorical(types, categories=sorted(MEDIA_TYPES) + ['omitted', 'other'])
+    df['media_bytes'] = sizes_column
+    return df
+
+
+def parse_zip(source, compact_layout=False):
+    """Parses a zip export given as bytes, a path or a seekable file-like object."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    with zipfile.ZipFile(source) as archive:
+        chat = chat_member(archive)
+        files = media_files(archive, chat)
+        with archive.open(chat) as stream:
+            df = preprocessor.preprocess(stream, compact_layout=compact_layout)
+    return add_media_columns(df, files)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        sys.exit(__doc__.strip().splitlines()[-1])
+    with zipfile.ZipFile(argv[0]) as archive:
+        chat = chat_member(archive)
+        files = media_files(archive, chat)
+    print("chat: %s" % chat)
+    summary = files.groupby('type')['bytes'].agg(['count', 'sum'])
+    for media, (count, size) in summary.iterrows():
+        print("%-9s %6d files %10.1f MB" % (media, count, size / 1024 ** 2))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""Throughput of emoji extraction: emoji_stats against the per-character loop it replaced.
+
+Usage: python benchmarks/bench_emoji.py [n_messages]
+"""
+import os
+import sys
+import time
+from collections import Counter
+
+import emoji
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import preprocessor  # noqa: E402
+import emoji_stats  # noqa: E402
+from synth import generate_chat  # noqa: E402
+
+
+def legacy_emoji_counts(messages):
+    # The original loop: one dict lookup per character, sequences split into codepoints
+    emojis = []
+    for message in messages:
+        emojis.extend([c for c in message if c in emoji.EMOJI_DATA])
+    return Counter(emojis)
+
+
+def main(n):
+    df = preprocessor.preprocess(generate_chat(n, emoji_rate=0.3))
+    messages = df['message']
+    # The trie and regex are built on first use, not part of the throughput
+    emoji_stats.emoji_tables()
+
+    start = time.perf_counter()
+    legacy = legacy_emoji_counts(messages)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = emoji_stats.EmojiTable(df)
+    counts = table.counts()
+    table_time = time.perf_counter() - start
+
+    print('%d messages, %d emojis (%d codepoints counted by the loop)' % (n, counts.sum(), sum(legacy.values())))
+    print('loop:        %10.0f messages/s' % (n / legacy_time))
+    print('emoji_stats: %10.0f messages/s  (%.1fx)' % (n / table_time, legacy_time / table_time))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if sys.argv[1:] else 200000)
@@ -0,0 +1,71 @@
+"""Checks links.count_links against per-message URLExtract.find_urls and times both.
+
+Usage: python benchmarks/bench_links.py [n_messages]
+"""
+import os
+import sys
+import time
+import random
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import links  # noqa: E402
+from synth import WORDS  # noqa: E402
+
+# Messages that are easy to get wrong in either direction
+FIXTURES = [
+    'see https://example.com/path?q=1&b=2 now',
+    'www.google.com and http://x.org',
+    'two links: a.co b.io',
+    'example.com.',
+    '(https://en.wikipedia.org/wiki/Python_(programming_language))',
+    'mail me at someone@example.com',
+    'ok...so what',
+    'version 1.5 released',
+    'file.txt attached',
+    'IMG-20230101-WA0001.jpg (file attached)',
+    'https://t.me/joinchat/abc\nsecond line youtu.be/xyz',
+    'no links here at all',
+    'HTTP://UPPER.CASE.COM/PATH',
+    'ftp://files.example.org/pub',
+    'dots...everywhere...',
+    '192.168.0.1:8080/admin',
+    'café.fr',
+    '',
+    '<Media omitted>',
+]
+
+
+def corpus(n, seed=0):
+    rng = random.Random(seed)
+    messages = list(FIXTURES)
+    while len(messages) < n:
+        words = rng.choices(WORDS, k=rng.randint(1, 12))
+        if rng.random() < 0.1:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(FIXTURES))
+        messages.append(' '.join(words))
+    return messages
+
+
+def main(n):
+    messages = corpus(n)
+
+    start = time.perf_counter()
+    expected = np.array([len(links.get_extractor().find_urls(message)) for message in messages])
+    per_message = time.perf_counter() - start
+
+    start = time.perf_counter()
+    counts = links.count_links(messages)
+    batched = time.perf_counter() - start
+
+    mismatches = np.flatnonzero(expected != counts)
+    for i in mismatches[:20]:
+        print('mismatch: %r expected %d got %d' % (messages[i], expected[i], counts[i]))
+    print('%d messages, %d links, %d mismatches' % (n, expected.sum(), len(mismatches)))
+    print('per message: %.3fs  batched: %.3fs  speedup: %.1fx' % (per_message, batched, per_message / batched))
+    return len(mismatches) == 0
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main(int(sys.argv[1]) if sys.argv[1:] else 50000) else 1)
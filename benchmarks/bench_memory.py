@@ -0,0 +1,50 @@
+"""Compares the memory of the full and the compact frame layouts of a synthetic chat.
+
+Prints the deep size of every column of both layouts, their totals and their
+ratio to the size of the exported text.
+
+Usage: python benchmarks/bench_memory.py [n_messages]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import preprocessor  # noqa: E402
+from synth import generate_chat  # noqa: E402
+
+MB = 1024 ** 2
+
+
+def parse(text, compact_layout):
+    start = time.perf_counter()
+    df = preprocessor.preprocess(text, compact_layout=compact_layout)
+    return df, time.perf_counter() - start
+
+
+def main(n):
+    text = generate_chat(n, n_users=20, emoji_rate=0.2, link_rate=0.02, multiline_rate=0.05,
+                         languages={'english': 3, 'hinglish': 2, 'hindi': 1})
+    raw = len(text.encode('utf-8'))
+    full, full_seconds = parse(text, False)
+    small, small_seconds = parse(text, True)
+    full_usage = full.memory_usage(deep=True, index=False)
+    small_usage = small.memory_usage(deep=True, index=False)
+
+    print("%d messages, %.1f MB of text" % (len(full), raw / MB))
+    print("%-12s %-16s %9s %-16s %9s" % ('column', 'full dtype', 'full MB', 'compact dtype', 'compact MB'))
+    for column in full.columns:
+        if column in small.columns:
+            compact_dtype, compact_size = str(small[column].dtype), "%9.2f" % (small_usage[column] / MB)
+        else:
+            compact_dtype, compact_size = 'derived', "%9s" % '-'
+        print("%-12s %-16s %9.2f %-16s %s" % (column, full[column].dtype, full_usage[column] / MB,
+                                             compact_dtype, compact_size))
+    print("%-12s %-16s %9.2f %-16s %9.2f" % ('total', '', full_usage.sum() / MB, '', small_usage.sum() / MB))
+    print("frame / text: full %.2fx, compact %.2fx; compact is %.0f%% of full"
+          % (full_usage.sum() / raw, small_usage.sum() / raw, 100 * small_usage.sum() / full_usage.sum()))
+    print("parse: full %.2fs, compact %.2fs" % (full_seconds, small_seconds))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,90 @@
+"""Compares preprocessor.preprocess with the original per-row implementation.
+
+Usage: python benchmarks/bench_preprocess.py [n_messages ...]
+"""
+import os
+import re
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import preprocessor  # noqa: E402
+from synth import generate_chat  # noqa: E402
+
+
+def legacy_preprocess(data):
+    # The implementation before the vectorized rewrite, kept here as the baseline
+    pattern = r'(\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\u202f[ap]m)\s-\s(.*)'
+    matches = re.findall(pattern, data)
+
+    messages = [match[1] for match in matches]
+    dates = [match[0] for match in matches]
+
+    df = pd.DataFrame({'user_message': messages, 'message_date': dates})
+    df['message_date'] = pd.to_datetime(df['message_date'], format='%d/%m/%y, %I:%M\u202f%p')
+    df.rename(columns={'message_date': 'date'}, inplace=True)
+
+    users = []
+    messages = []
+    for message in df['user_message']:
+        entry = re.split(r'([\w\W]+?):\s', message)
+        if entry[1:]:
+            users.append(entry[1])
+            messages.append(" ".join(entry[2:]))
+        else:
+            users.append('group_notification')
+            messages.append(entry[0])
+
+    df['user'] = users
+    df['message'] = messages
+    df.drop(columns=['user_message'], inplace=True)
+    df['is_media'] = df['message'] == '<Media omitted>'
+
+    df['only_date'] = df['date'].dt.date
+    df['year'] = df['date'].dt.year
+    df['month_num'] = df['date'].dt.month
+    df['month'] = df['date'].dt.month_name()
+    df['day'] = df['date'].dt.day
+    df['day_name'] = df['date'].dt.day_name()
+    df['hour'] = df['date'].dt.hour
+    df['minute'] = df['date'].dt.minute
+
+    period = []
+    for hour in df[['day_name', 'hour']]['hour']:
+        if hour == 23:
+            period.append(str(hour) + "-" + str('00'))
+        elif hour == 0:
+            period.append(str('00') + "-" + str(hour + 1))
+        else:
+            period.append(str(hour) + "-" + str(hour + 1))
+    df['period'] = period
+
+    return df
+
+
+def run(func, data):
+    start = time.perf_counter()
+    df = func(data)
+    elapsed = time.perf_counter() - start
+    return df, elapsed, df.memory_usage(deep=True).sum() / 2 ** 20
+
+
+def main(sizes):
+    print('%10s %12s %12s %12s %12s %8s' % ('messages', 'legacy s', 'current s', 'legacy MiB', 'current MiB', 'speedup'))
+    for n in sizes:
+        data = generate_chat(n)
+        old, old_time, old_mem = run(legacy_preprocess, data)
+        new, new_time, new_mem = run(preprocessor.preprocess, data)
+
+        # Both must produce the same chat
+        assert len(old) == len(new)
+        assert (old['user'] == new['user'].astype(object)).all()
+        assert (old['period'] == new['period'].astype(object)).all()
+
+        print('%10d %12.3f %12.3f %12.1f %12.1f %7.1fx' % (n, old_time, new_time, old_mem, new_mem, old_time / new_time))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000])
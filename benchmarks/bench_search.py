@@ -0,0 +1,81 @@
+"""Checks search.SearchIndex against str.contains scans of the messages and times both.
+
+Keywords are matched by the scan as whole words, phrases as words separated by
+anything but word characters, both ignoring case, on the text messages only.
+
+Usage: python benchmarks/bench_search.py [n_messages]
+"""
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import preprocessor  # noqa: E402
+import chat_index  # noqa: E402
+import search  # noqa: E402
+from synth import generate_chat  # noqa: E402
+
+# (query, user) pairs: common and rare keywords, phrases, several phrases, a user filter
+QUERIES = [
+    ('hello', 'Overall'),
+    ('meeting', 'Overall'),
+    ('nahi', 'Overall'),
+    ('"kal kaam"', 'Overall'),
+    ('"lunch today" coffee', 'Overall'),
+    ('project deadline', 'Overall'),
+    ('hello', 'User 3'),
+    ('notaword', 'Overall'),
+]
+RUNS = 5
+
+
+def scan(text, query, selected_user, users):
+    # What a user grepping the frame does: one regex per phrase over every message
+    found = np.ones(len(text), dtype=bool)
+    for terms in search.parse_query(query):
+        pattern = r'\b' + r'\W+'.join(re.escape(term) for term in terms) + r'\b'
+        found &= text.str.contains(pattern, case=False, regex=True).to_numpy(dtype=bool)
+    if selected_user != 'Overall':
+        found &= users == selected_user
+    return np.flatnonzero(found)
+
+
+def timed(func):
+    seconds = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - start)
+    return result, min(seconds)
+
+
+def main(n):
+    df = preprocessor.preprocess(generate_chat(n, n_users=20, emoji_rate=0.2, link_rate=0.02, multiline_rate=0.05,
+                                               languages={'english': 3, 'hinglish': 2, 'hindi': 1}))
+    text_rows = chat_index.get_index(df).text
+    text = df['message'].iloc[text_rows]
+    users = df['user'].iloc[text_rows].to_numpy(dtype=object)
+
+    start = time.perf_counter()
+    index = search.get_search_index(df)
+    print('%d messages, index built in %.2fs, %.1f MB (%.1f MB of postings)'
+          % (len(df), time.perf_counter() - start, index.nbytes() / 1024 ** 2, index.postings.nbytes / 1024 ** 2))
+
+    ok = True
+    print('%-24s %-8s %8s %10s %10s %9s' % ('query', 'user', 'hits', 'index ms', 'scan ms', 'speedup'))
+    for query, selected_user in QUERIES:
+        ids, indexed = timed(lambda: index.search(query, selected_user))
+        expected, scanned = timed(lambda: text_rows[scan(text, query, selected_user, users)])
+        if not np.array_equal(ids, expected):
+            ok = False
+            print('mismatch: %r found %d, scan found %d' % (query, len(ids), len(expected)))
+        print('%-24s %-8s %8d %10.2f %10.1f %8.0fx' % (query, selected_user, len(ids), indexed * 1000, scanned * 1000,
+                                                     scanned / max(indexed, 1e-9)))
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main(int(sys.argv[1]) if sys.argv[1:] else 200000) else 1)
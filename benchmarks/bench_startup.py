@@ -0,0 +1,45 @@
+"""Cold import time of helper.py, against loading its heavy dependencies up front.
+
+Each measurement runs in a fresh interpreter. The eager case imports helper and
+then everything it used to load at import time (sklearn, wordcloud, textblob,
+nltk, urlextract with its TLD list, the emoji tables).
+
+Usage: python benchmarks/bench_startup.py [repeats]
+"""
+import os
+import sys
+import subprocess
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LAZY = "import helper"
+EAGER = """import helper
+import sklearn.feature_extraction.text, sklearn.decomposition, wordcloud, textblob, nltk
+helper.links.get_extractor()
+helper.emoji_stats.emoji_tables()
+"""
+# Loaded by helper.py only when the analysis needing them runs
+HEAVY = ['sklearn', 'wordcloud', 'textblob', 'nltk', 'urlextract', 'emoji', 'matplotlib']
+
+
+def timed_import(code):
+    script = ("import time, sys\nstart = time.perf_counter()\n%s\n"
+              "print(time.perf_counter() - start)\n"
+              "print(' '.join(name for name in %r if name in sys.modules))" % (code, HEAVY))
+    output = subprocess.run([sys.executable, '-c', script], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout.splitlines()
+    return float(output[0]), output[1].split() if len(output) > 1 else []
+
+
+def main(repeats):
+    results = {}
+    for name, code in (('lazy', LAZY), ('eager', EAGER)):
+        runs = [timed_import(code) for _ in range(repeats)]
+        results[name] = statistics.median(seconds for seconds, _ in runs)
+        print('%-6s %6.3fs  loaded: %s' % (name, results[name], ', '.join(runs[0][1]) or 'none'))
+    print('speedup: %.1fx' % (results['eager'] / results['lazy']))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if sys.argv[1:] else 5)
@@ -0,0 +1,192 @@
+"""Times and memory-profiles every pipeline stage and helper.py analysis on synthetic chats.
+
+`run` writes one JSON file per run, `compare` reports the changes between two of them.
+
+Usage: python benchmarks/bench_suite.py run [--sizes 10000,100000,1000000] [--out FILE]
+                                            [--only NAME,...] [--skip NAME,...] [--no-memory]
+       python benchmarks/bench_suite.py compare BASE.json NEW.json [--threshold 0.1] [--min-seconds 0.01]
+"""
+import os
+import sys
+import json
+import time
+import inspect
+import argparse
+import platform
+import datetime
+import subprocess
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import preprocessor  # noqa: E402
+import cache  # noqa: E402
+import chat_index  # noqa: E402
+import activity  # noqa: E402
+import text_stats  # noqa: E402
+import links  # noqa: E402
+import emoji_stats  # noqa: E402
+import sentiment  # noqa: E402
+import helper  # noqa: E402
+from synth import generate_chat  # noqa: E402
+
+SIZES = (10000, 100000, 1000000)
+# Chat options closer to a real export than the generator defaults
+CHAT_OPTIONS = dict(n_users=20, emoji_rate=0.2, link_rate=0.02, multiline_rate=0.05,
+                    languages={'english': 3, 'hinglish': 2, 'hindi': 1})
+
+# Structures shared by the analyses, built directly so each is measured alone
+STAGES = [
+    ('preprocess', lambda data, df: preprocessor.preprocess(data)),
+    ('chat_index', lambda data, df: chat_index.ChatIndex(df)),
+    ('activity', lambda data, df: activity.ActivityCube(df)),
+    ('tokens', lambda data, df: text_stats.TokenTable(df)),
+    ('link_counts', lambda data, df: links.count_links(df['message'])),
+    ('emojis', lambda data, df: emoji_stats.EmojiTable(df)),
+    ('sentiment_scores', lambda data, df: sentiment.score_texts(df['message'])),
+]
+HELPERS = ['fetch_stats', 'most_busy_users', 'monthly_timeline', 'daily_timeline', 'week_activity_map',
+           'month_activity_map', 'activity_heatmap', 'create_wordcloud', 'most_common_words', 'emoji_helper',
+           'sentiment_analysis', 'response_time_analysis', 'message_length_analysis', 'topic_modeling']
+
+
+def measure(func, memory=True):
+    """Returns (seconds, peak traced bytes or None) of one call.
+
+    Memory is traced in a second call: tracing slows Python code down and would
+    distort the time.
+    """
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    if not memory:
+        return seconds, None
+    tracemalloc.start()
+    try:
+        func()
+        return seconds, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def environment():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'revision': revision,
+            'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'numpy': np.__version__, 'pandas': pd.__version__}
+
+
+def run_size(size, selected, memory=True):
+    data = generate_chat(size, **CHAT_OPTIONS)
+    results = []
+
+    def record(name, func, user=None):
+        seconds, peak = measure(func, memory)
+        results.append({'size': size, 'name': name, 'user': user, 'seconds': round(seconds, 6), 'peak_bytes': peak})
+        print('%9d %-24s %-10s %9.3fs %s' % (size, name, user or '', seconds,
+                                              '%8.1f MB' % (peak / 1024 ** 2) if peak is not None else ''))
+
+    df = preprocessor.preprocess(data)
+    top_user = df.loc[df['user'] != 'group_notification', 'user'].value_counts().index[0]
+    for name, stage in STAGES:
+        if name in selected:
+            record(name, lambda: stage(data, df))
+
+    # Analyses run on warm chat structures, each call with an empty result cache
+    for get in (chat_index.get_index, activity.get_activity, text_stats.get_tokens, links.get_link_counts,
+                emoji_stats.get_emojis):
+        get(df)
+    if 'sentiment_analysis' in selected:
+        sentiment.get_scores(df)
+    for name in HELPERS:
+        if name not in selected:
+            continue
+        func = getattr(helper, name)
+        users = ['Overall', top_user] if 'selected_user' in inspect.signature(func).parameters else [None]
+        for user in users:
+            args = (user, df) if user else (df,)
+
+            def call():
+                cache.results.clear()
+                func(*args)
+            record(name, call, user)
+
+    cache.structures.clear()
+    cache.results.clear()
+    return results
+
+
+def run(args):
+    names = [name for name, _ in STAGES] + HELPERS
+    selected = set(args.only.split(',')) if args.only else set(names)
+    selected -= set(args.skip.split(',')) if args.skip else set()
+    unknown = selected - set(names)
+    if unknown:
+        sys.exit("unknown stages: %s" % ', '.join(sorted(unknown)))
+
+    report = {'environment': environment(), 'options': {key: str(value) for key, value in CHAT_OPTIONS.items()},
+              'results': []}
+    for size in (int(size) for size in args.sizes.split(',')):
+        report['results'].extend(run_size(size, selected, memory=not args.no_memory))
+
+    out = args.out or 'bench-%s.json' % datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=1)
+    print('results written to %s' % out)
+
+
+def compare(args):
+    def load(path):
+        with open(path) as f:
+            return {(item['size'], item['name'], item['user']): item for item in json.load(f)['results']}
+
+    base, new = load(args.base), load(args.new)
+    regressions = 0
+    print('%9s %-24s %-10s %10s %10s %7s %9s' % ('size', 'name', 'user', 'base', 'new', 'time', 'memory'))
+    for key in sorted(base.keys() & new.keys(), key=lambda key: (key[0], key[1], key[2] or '')):
+        old, current = base[key], new[key]
+        ratio = current['seconds'] / old['seconds'] if old['seconds'] else float('nan')
+        memory = ''
+        if old['peak_bytes'] and current['peak_bytes'] is not None:
+            memory = '%.2fx' % (current['peak_bytes'] / old['peak_bytes'])
+        flag = ''
+        # Timings of a few milliseconds are mostly noise
+        if ratio > 1 + args.threshold and max(old['seconds'], current['seconds']) >= args.min_seconds:
+            regressions += 1
+            flag = '  slower'
+        print('%9d %-24s %-10s %9.3fs %9.3fs %6.2fx %9s%s' % (key[0], key[1], key[2] or '', old['seconds'],
+                                                              current['seconds'], ratio, memory, flag))
+    print('%d of %d measurements more than %d%% slower' % (regressions, len(base.keys() & new.keys()),
+                                                             args.threshold * 100))
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help="benchmark the current tree")
+    run_parser.add_argument('--sizes', default=','.join(map(str, SIZES)), help="numbers of messages")
+    run_parser.add_argument('--out', help="result file (default: bench-<date>.json)")
+    run_parser.add_argument('--only', help="comma separated stages and helper functions to run")
+    run_parser.add_argument('--skip', help="comma separated stages and helper functions to leave out")
+    run_parser.add_argument('--no-memory', action='store_true', help="only measure time")
+    compare_parser = commands.add_parser('compare', help="compare two result files")
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help="slowdown reported as a regression (default: %(default)s)")
+    compare_parser.add_argument('--min-seconds', type=float, default=0.01,
+                                help="shorter timings are never reported (default: %(default)s)")
+    args = parser.parse_args(argv)
+    return run(args) if args.command == 'run' else compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
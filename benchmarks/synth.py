@@ -0,0 +1,121 @@
+"""Seeded generator of synthetic WhatsApp exports used by the benchmarks.
+
+Usage: python benchmarks/synth.py OUT_FILE N_MESSAGES [--users N] [--layout NAME] ...
+"""
+import sys
+import random
+import argparse
+from datetime import datetime, timedelta
+
+WORDS = ['hello', 'ok', 'haha', 'yes', 'no', 'meeting', 'tomorrow', 'today', 'lunch', 'call',
+         'project', 'deadline', 'weekend', 'movie', 'coffee', 'please', 'thanks', 'sure',
+         'where', 'when', 'going', 'home', 'office', 'done', 'great', 'nice', 'bhai', 'kal',
+         'acha', 'theek', 'hai', 'nahi', 'kya', 'the', 'and', 'is', 'it', 'to', 'we', 'you']
+# Vocabularies picked per message with `languages`
+VOCABULARIES = {
+    'english': ['hello', 'ok', 'yes', 'no', 'meeting', 'tomorrow', 'today', 'lunch', 'call', 'project',
+                'deadline', 'weekend', 'movie', 'coffee', 'please', 'thanks', 'sure', 'where', 'when',
+                'going', 'home', 'office', 'done', 'great', 'nice', 'the', 'and', 'is', 'it', 'to', 'we', 'you'],
+    'hinglish': ['bhai', 'kal', 'acha', 'theek', 'hai', 'nahi', 'kya', 'haan', 'chalo', 'yaar', 'kaise',
+                 'ho', 'mein', 'tum', 'aaj', 'kaam', 'khana', 'ghar', 'abhi', 'baad', 'haha', 'ok'],
+    'hindi': ['\u0928\u092e\u0938\u094d\u0924\u0947', '\u0939\u093e\u0901', '\u0928\u0939\u0940\u0902',
+              '\u0915\u0932', '\u0906\u091c', '\u0918\u0930', '\u0915\u093e\u092e', '\u0920\u0940\u0915',
+              '\u0939\u0948', '\u0915\u094d\u092f\u093e', '\u092d\u093e\u0908', '\u0905\u091a\u094d\u091b\u093e'],
+}
+# Single codepoints, skin tones, ZWJ sequences, flags and keycaps
+EMOJIS = ['\U0001F602', '\u2764\ufe0f', '\U0001F44D', '\U0001F44D\U0001F3FD', '\U0001F64F', '\U0001F525',
+          '\U0001F468\u200d\U0001F469\u200d\U0001F467', '\U0001F1EE\U0001F1F3', '1\ufe0f\u20e3', '\U0001F60D']
+LINKS = ['https://example.com/post/%d', 'http://news.example.org/a?id=%d', 'www.youtube.com/watch?v=%d',
+         'github.com/user/repo/issues/%d', 'https://maps.example.net/@%d,12z']
+
+# The layout of the exports the analyzer was first written for, see preprocessor.LAYOUTS
+DEFAULT_LAYOUT = 'android-dmy-yy-12h-narrow'
+
+
+def format_timestamp(t, layout=DEFAULT_LAYOUT):
+    """Formats `t` like the exports of a preprocessor.LAYOUTS layout, e.g. 12/01/23, 9:05 am."""
+    platform, order, years, clock = layout.split('-', 3)
+    first, second = (t.day, t.month) if order == 'dmy' else (t.month, t.day)
+    seconds = ':%02d' % t.second if platform == 'ios' else ''
+    if clock == '24h':
+        clock_time = '%02d:%02d%s' % (t.hour, t.minute, seconds)
+    else:
+        clock_time = '%d:%02d%s%s%s' % ((t.hour % 12) or 12, t.minute, seconds,
+                                        '\u202f' if clock == '12h-narrow' else ' ',
+                                        'am' if t.hour < 12 else 'pm')
+    return '%d/%02d/%s, %s' % (first, second, t.strftime('%y' if years == 'yy' else '%Y'), clock_time)
+
+
+def format_header(t, layout=DEFAULT_LAYOUT):
+    """Returns the start of a message line, up to the user name."""
+    if layout.startswith('ios'):
+        return '[%s] ' % format_timestamp(t, layout)
+    return format_timestamp(t, layout) + ' - '
+
+
+def generate_chat(n_messages, n_users=10, seed=0, start=datetime(2021, 1, 1), days=3 * 365, emoji_rate=0.0,
+                  media_rate=0.05, link_rate=0.0, multiline_rate=0.0, languages=None, layout=DEFAULT_LAYOUT):
+    """Returns the text of an export with `n_messages` messages from `n_users` users over `days` days.
+
+    The rates are the shares of messages that are a media placeholder, end with a
+    few emojis, hold a link or span several lines. `languages` maps vocabularies of
+    VOCABULARIES to weights, picked per message, the default uses WORDS. `layout`
+    names the timestamp format, one of preprocessor.LAYOUTS.
+    """
+    rng = random.Random(seed)
+    users = ['User %d' % i for i in range(n_users)]
+    weights = [1.0 / (i + 1) for i in range(n_users)]
+    step = days * 86400.0 / max(n_messages, 1)
+    if languages:
+        vocabularies = [VOCABULARIES[name] for name in languages]
+        language_weights = list(languages.values())
+
+    lines = [format_header(start, layout) + 'Messages and calls are end-to-end encrypted.']
+    t = start
+    for user in rng.choices(users, weights, k=n_messages):
+        t += timedelta(seconds=int(rng.expovariate(1.0 / step)))
+        if rng.random() < media_rate:
+            text = '<Media omitted>'
+        else:
+            # Options left at 0 draw nothing, the default chat stays the same
+            words = rng.choices(vocabularies, language_weights)[0] if languages else WORDS
+            text = ' '.join(rng.choices(words, k=rng.randint(1, 15)))
+            if multiline_rate and rng.random() < multiline_rate:
+                text += ''.join('\n' + ' '.join(rng.choices(words, k=rng.randint(1, 8)))
+                                for _ in range(rng.randint(1, 3)))
+            if link_rate and rng.random() < link_rate:
+                text += ' ' + rng.choice(LINKS) % rng.randrange(100000)
+            if rng.random() < emoji_rate:
+                text += ' ' + ''.join(rng.choices(EMOJIS, k=rng.randint(1, 4)))
+        lines.append(format_header(t, layout) + user + ': ' + text)
+
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('out', help="file to write the export to")
+    parser.add_argument('messages', type=int)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--days', type=int, default=3 * 365)
+    parser.add_argument('--emoji-rate', type=float, default=0.0)
+    parser.add_argument('--media-rate', type=float, default=0.05)
+    parser.add_argument('--link-rate', type=float, default=0.0)
+    parser.add_argument('--multiline-rate', type=float, default=0.0)
+    parser.add_argument('--languages', help="weights per vocabulary, e.g. english=3,hinglish=1,hindi=1")
+    parser.add_argument('--layout', default=DEFAULT_LAYOUT, help="timestamp format, one of preprocessor.LAYOUTS")
+    args = parser.parse_args(argv)
+
+    languages = None
+    if args.languages:
+        languages = {name: float(weight) for name, weight in (item.split('=') for item in args.languages.split(','))}
+    text = generate_chat(args.messages, args.users, args.seed, days=args.days, emoji_rate=args.emoji_rate,
+                         media_rate=args.media_rate, link_rate=args.link_rate,
+                         multiline_rate=args.multiline_rate, languages=languages, layout=args.layout)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,317 @@
+import os
+import sys
+import hashlib
+import inspect
+import logging
+import weakref
+import functools
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import preprocessor
+import profiling
+
+logger = logging.getLogger(__name__)
+
+
+def content_key(data):
+    """Returns the hex digest identifying an uploaded export."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ParseCache:
+    """Parsed chat frames keyed by the hash of the uploaded bytes.
+
+    Frames are kept in memory up to `max_bytes` and the least recently used ones
+    are evicted first. With `disk_dir` set, every parsed frame is also written there
+    as Parquet so a known export is only read back, not parsed again. The files are
+    kept up to `max_disk_bytes`, the least recently read ones are deleted first.
+    """
+
+    def __init__(self, max_bytes=1024 ** 3, disk_dir=None, max_disk_bytes=4 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_dir = disk_dir if disk_dir and _parquet_available() else None
+        if disk_dir and self.disk_dir is None:
+            logger.warning("pyarrow is not installed, the on-disk parse cache is disabled")
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key + '.parquet')
+
+    def _trim_disk(self, keep):
+        # Oldest files first by modification time, reads touch their file
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith('.parquet'):
+                try:
+                    info = os.stat(os.path.join(self.disk_dir, name))
+                except OSError:
+                    continue
+                files.append((info.st_mtime, info.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            # Always keep the newest frame, even when it alone is over the limit
+            if name == os.path.basename(keep):
+                continue
+            try:
+                os.remove(os.path.join(self.disk_dir, name))
+            except OSError:
+                continue
+            total -= size
+            self.disk_evictions += 1
+
+    def _remember(self, key, df):
+        size = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (df, size)
+            self.size += size
+            # Always keep the newest frame, even when it alone is over the limit
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def get(self, data, parse=preprocessor.preprocess, variant=None):
+        """Returns the parsed frame for the uploaded bytes, parsing them only when unknown.
+
+        `variant` names the layout `parse` returns (e.g. 'compact'), so layouts of the same export are kept apart.
+        """
+        key = content_key(data) if variant is None else content_key(data) + '-' + variant
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                profiling.note_cache(True)
+                return self._entries[key][0]
+
+        df = None
+        if self.disk_dir and os.path.exists(self._path(key)):
+            try:
+                df = pd.read_parquet(self._path(key))
+                os.utime(self._path(key))
+                self.disk_hits += 1
+                profiling.note_cache(True)
+            except Exception:
+                logger.exception("Could not read cached frame %s, parsing again", key)
+
+        if df is None:
+            self.misses += 1
+            profiling.note_cache(False)
+            df = parse(data)
+            if self.disk_dir:
+                try:
+                    df.to_parquet(self._path(key))
+                    self._trim_disk(self._path(key))
+                except Exception:
+                    logger.exception("Could not write cached frame %s", key)
+
+        stamp(df, key)
+        self._remember(key, df)
+        return df
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.size, 'hits': self.hits,
+                    'disk_hits': self.disk_hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'disk_evictions': self.disk_evictions}
+
+
+# Frames stamped with the key of their source, by id. pandas copies attrs to the frames
+# derived from a stamped one (assign, copy, sort_values...), never this entry
+_stamped = weakref.WeakValueDictionary()
+
+
+def stamp(df, key):
+    """Identifies `df` itself, not the frames later derived from it, as the chat `key`."""
+    df.attrs['fingerprint'] = key
+    _stamped[id(df)] = df
+
+
+def fingerprint(df):
+    """Returns an identifier of the chat held in `df`.
+
+    Frames stamped by ParseCache or the chat store carry the hash of their source.
+    Every other frame, including those derived from a stamped one, is hashed once
+    and stamped with the result.
+    """
+    if _stamped.get(id(df)) is df:
+        return df.attrs['fingerprint']
+
+    hashes = pd.util.hash_pandas_object(df[['date', 'user', 'message']], index=False)
+    key = hashlib.blake2b(hashes.to_numpy().tobytes(), digest_size=16).hexdigest()
+    stamp(df, key)
+    return key
+
+
+def estimate_size(value, depth=3):
+    """Rough number of bytes held by an analysis result."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if depth == 0:
+        return sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(estimate_size(item, depth - 1) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(item, depth - 1) for item in value.values())
+    if hasattr(value, '__dict__'):
+        # Models, indexes and word clouds: count what they hold, a few levels deep
+        return sys.getsizeof(value) + sum(estimate_size(item, depth - 1) for item in vars(value).values())
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """Analysis results keyed by (dataset fingerprint, selected user, function, parameters).
+
+    Results are evicted least recently used first once they hold more than
+    `max_bytes`, or more than `max_entries` when that is set.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 ** 2, max_entries=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns (True, result) for a known key and (False, None) otherwise."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key][0]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes or (self.max_entries and len(self._entries) > self.max_entries):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.size, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+
+# Shared by every memoized analysis of the process
+results = ResultCache(max_bytes=int(os.environ.get('CHAT_RESULT_CACHE_MB', 256)) * 1024 ** 2)
+
+
+# Structures derived from a whole chat (indexes, token tables...) shared by its analyses
+structures = ResultCache(max_bytes=int(os.environ.get('CHAT_STRUCTURE_CACHE_MB', 512)) * 1024 ** 2)
+
+
+# Rendered images (word clouds) keyed by what they were drawn from, not by chat
+images = ResultCache(max_bytes=int(os.environ.get('CHAT_IMAGE_CACHE_MB', 64)) * 1024 ** 2)
+
+
+# Chart figures as the JSON sent to the browser, see charts.figure_json
+figures = ResultCache(max_bytes=int(os.environ.get('CHAT_FIGURE_CACHE_MB', 64)) * 1024 ** 2)
+
+
+_build_locks = {}
+_build_locks_lock = threading.Lock()
+
+
+def per_chat(df, name, build):
+    """Returns build(df), built once per chat and kept in `structures`.
+
+    Analyses running in parallel threads wait for a structure another one is
+    building instead of building it again.
+    """
+    key = (fingerprint(df), name)
+    found, value = structures.get(key)
+    if found:
+        return value
+    with _build_locks_lock:
+        lock = _build_locks.setdefault(key, threading.Lock())
+    with lock:
+        found, value = structures.get(key)
+        if not found:
+            with profiling.span('build ' + name, rows=len(df)):
+                value = build(df)
+            structures.put(key, value)
+    with _build_locks_lock:
+        _build_locks.pop(key, None)
+    return value
+
+
+def _freeze(value):
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+def memoize(func):
+    """Caches the results of an analysis taking the chat frame as its `df` argument.
+
+    The frame is identified by its fingerprint, every other argument is part of
+    the key as given. Results are shared between callers and must not be modified.
+    """
+    signature = inspect.signature(func)
+
+    def cache_key(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        params = tuple((name, _freeze(value)) for name, value in bound.arguments.items() if name != 'df')
+        return (fingerprint(bound.arguments['df']), func.__qualname__, params)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = cache_key(*args, **kwargs)
+        found, value = results.get(key)
+        profiling.note_cache(found)
+        if not found:
+            value = func(*args, **kwargs)
+            results.put(key, value)
+        return value
+
+    # Results computed elsewhere (e.g. in a worker process) are stored under this key
+    wrapper.cache_key = cache_key
+    return wrapper
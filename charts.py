@@ -0,0 +1,117 @@
+"""Chart data sent to the browser: downsampled series, WebGL traces and cached figure JSON.
+
+Long series are shrunk to MAX_POINTS with a shape-preserving downsampling
+(Largest-Triangle-Three-Buckets, or the minimum and maximum of every bucket),
+larger traces than WEBGL_POINTS are drawn with WebGL, and figures are kept as
+JSON per (chat, user, view) so a rerun sends the same payload without building
+it again.
+"""
+import numpy as np
+import pandas as pd
+import cache
+import profiling
+
+# Points of a series sent to the browser at most
+MAX_POINTS = 2000
+# Line charts with more points are drawn with WebGL (Scattergl)
+WEBGL_POINTS = 1000
+METHODS = ('lttb', 'minmax')
+
+
+def lttb(x, y, n_out):
+    """Returns the positions of the `n_out` points kept by Largest-Triangle-Three-Buckets.
+
+    The first and last points are kept. Every other point is the one of its bucket
+    forming the largest triangle with the previous kept point and the average of
+    the next bucket, so peaks and dips survive.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # n_out - 2 buckets between the first and the last point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_x = x[end:edges[bucket + 2]].mean()
+            next_y = y[end:edges[bucket + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(area.argmax())
+        kept[bucket + 1] = previous
+    return kept
+
+
+def minmax(y, n_out):
+    """Returns the positions of the minimum and maximum of `n_out` / 2 buckets, in order."""
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(0, n, n_out // 2 + 1).astype(np.int64)
+    kept = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            kept.extend((start + int(y[start:end].argmin()), start + int(y[start:end].argmax())))
+    return np.unique(kept)
+
+
+def _numeric(values):
+    # Dates and times as nanoseconds, labels (e.g. 'January-2023') as their position
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=float)
+    try:
+        return pd.to_datetime(values).to_numpy(dtype='datetime64[ns]').view(np.int64).astype(float)
+    except (TypeError, ValueError):
+        return np.arange(len(values), dtype=float)
+
+
+def downsample(frame, x, y, max_points=MAX_POINTS, method='lttb'):
+    """Returns the rows of `frame` kept to draw column `y` against `x` with at most `max_points` points."""
+    if len(frame) <= max_points:
+        return frame
+    if method == 'lttb':
+        kept = lttb(_numeric(frame[x]), frame[y].to_numpy(), max_points)
+    elif method == 'minmax':
+        kept = minmax(frame[y].to_numpy(), max_points)
+    else:
+        raise ValueError("Unknown downsampling method %r, expected one of %s" % (method, ', '.join(METHODS)))
+    return frame.iloc[kept]
+
+
+def line(frame, x, y, max_points=MAX_POINTS, method='lttb', **kwargs):
+    """px.line of a downsampled `frame`, drawn with WebGL above WEBGL_POINTS points."""
+    import plotly.express as px
+    frame = downsample(frame, x, y, max_points, method)
+    return px.line(frame, x=x, y=y, render_mode='webgl' if len(frame) > WEBGL_POINTS else 'svg', **kwargs)
+
+
+def histogram(values, nbins=50, **kwargs):
+    """Bar chart of the `nbins` bin counts of `values`, binned here instead of in the browser."""
+    import plotly.express as px
+    counts, edges = np.histogram(np.asarray(values, dtype=float), bins=nbins)
+    fig = px.bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, **kwargs)
+    fig.update_layout(bargap=0)
+    return fig
+
+
+def figure_json(df, selected_user, view, build):
+    """Returns the JSON of the figure `build()`, built once per (chat, user, view).
+
+    `view` names the chart and every option it depends on, e.g. ('response', 60).
+    """
+    key = (cache.fingerprint(df), selected_user, view)
+    found, payload = cache.figures.get(key)
+    profiling.note_cache(found)
+    if not found:
+        payload = build().to_json()
+        cache.figures.put(key, payload)
+    return payload
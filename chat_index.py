@@ -0,0 +1,50 @@
+import numpy as np
+import cache
+
+
+class ChatIndex:
+    """Row positions of every user's messages in a parsed chat.
+
+    Built once per chat with a single group-by, so taking one user's rows costs
+    O(rows of that user) instead of a boolean mask over the whole frame.
+    Group notifications and media rows are separated at build time.
+    """
+
+    def __init__(self, df):
+        self.rows = len(df)
+        self.positions = df.groupby('user', observed=True, sort=False).indices
+
+        notification = (df['user'] == 'group_notification').to_numpy()
+        is_media = df['is_media'].to_numpy(dtype=bool)
+        self.notifications = np.flatnonzero(notification)
+        self.media = np.flatnonzero(is_media)
+
+        # Rows with actual text: neither notifications nor media
+        self.text = np.flatnonzero(~notification & ~is_media)
+        self.text_positions = df.iloc[self.text].groupby('user', observed=True, sort=False).indices
+        self.text_positions = {user: self.text[positions] for user, positions in self.text_positions.items()}
+
+    def users(self):
+        return sorted(user for user in self.positions if user != 'group_notification')
+
+    def user_positions(self, selected_user, messages_only=False):
+        """Returns the row positions of `selected_user`, or of everyone for 'Overall'."""
+        if selected_user == 'Overall':
+            return self.text if messages_only else np.arange(self.rows)
+        positions = self.text_positions if messages_only else self.positions
+        return positions.get(selected_user, np.array([], dtype=np.int64))
+
+
+def get_index(df):
+    """Returns the ChatIndex of `df`, building it on first use."""
+    return cache.per_chat(df, 'chat_index', ChatIndex)
+
+
+def user_rows(selected_user, df, messages_only=False):
+    """Returns the rows of `selected_user` ('Overall' for everyone).
+
+    With `messages_only`, group notifications and media rows are left out.
+    """
+    if selected_user == 'Overall' and not messages_only:
+        return df
+    return df.iloc[get_index(df).user_positions(selected_user, messages_only)]
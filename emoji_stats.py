@@ -0,0 +1,166 @@
+import re
+import functools
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import cache
+
+
+def _build_trie(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = word
+    return trie
+
+
+def _char_class(chars):
+    # Consecutive code points are merged into ranges, a class of single characters
+    # is checked one by one by the regex engine
+    ranges = []
+    for code in sorted(map(ord, chars)):
+        if ranges and code == ranges[-1][1] + 1:
+            ranges[-1][1] = code
+        else:
+            ranges.append([code, code])
+    return '[%s]' % ''.join(re.escape(chr(low)) if low == high else '%s-%s' % (re.escape(chr(low)), re.escape(chr(high)))
+                            for low, high in ranges)
+
+
+ZWJ = '\u200d'
+REGIONAL_INDICATORS = frozenset(chr(code) for code in range(0x1F1E6, 0x1F200))
+
+
+def _sequence_pattern(words):
+    # Shape of an emoji sequence built only from character classes, so the regex engine
+    # finds candidates at C speed: a base character followed by modifiers (variation
+    # selectors, skin tones, keycap, tags), possibly joined to more of them by ZWJ.
+    # Flags are pairs of regional indicators, keycaps start with an ASCII character.
+    bases = set()
+    modifiers = set()
+    keycap_bases = set()
+    for word in words:
+        if word[0].isascii():
+            keycap_bases.add(word[0])
+        elif word[0] not in REGIONAL_INDICATORS:
+            bases.add(word[0])
+        for previous, char in zip(word, word[1:]):
+            if char != ZWJ and previous != ZWJ and char not in REGIONAL_INDICATORS:
+                modifiers.add(char)
+        bases.update(char for previous, char in zip(word, word[1:]) if previous == ZWJ)
+
+    element = _char_class(bases) + _char_class(modifiers) + '*'
+    pattern = '%s(?:%s%s)*|%s{1,2}|%s%s+' % (element, ZWJ, element, _char_class(REGIONAL_INDICATORS),
+                                             _char_class(keycap_bases), _char_class(modifiers))
+    # Large classes are checked range by range, a single range rejects plain text first
+    lowest = min(ord(char) for char in bases)
+    return '(?=%s|[\\U%08x-\\U0010ffff])(?:%s)' % (_char_class(keycap_bases), lowest, pattern)
+
+
+EmojiTables = namedtuple('EmojiTables', ['words', 'trie', 'max_length', 'sequence'])
+
+
+@functools.lru_cache(maxsize=None)
+def emoji_tables():
+    """Returns every known emoji, their character trie (including ZWJ sequences, skin
+    tones, flags and keycaps), the longest length and the sequence regex.
+
+    Built on first use, compiling the regex takes a noticeable part of a second.
+    """
+    import emoji
+    words = emoji.EMOJI_DATA
+    return EmojiTables(words, _build_trie(words), max(len(word) for word in words),
+                       re.compile(_sequence_pattern(words)))
+
+
+def _split(sequence, tables):
+    # Longest known emojis in a candidate that isn't one emoji as a whole
+    position = 0
+    while position < len(sequence):
+        node = tables.trie
+        found = None
+        for char in sequence[position:position + tables.max_length]:
+            node = node.get(char)
+            if node is None:
+                break
+            if '' in node:
+                found = node['']
+        if found is None:
+            position += 1
+        else:
+            yield position, found
+            position += len(found)
+
+
+def _scan(text):
+    # Nearly every candidate is exactly one emoji, the trie is only walked for the rest
+    tables = emoji_tables()
+    for match in tables.sequence.finditer(text):
+        sequence = match.group()
+        if sequence in tables.words:
+            yield match.start(), sequence
+        else:
+            start = match.start()
+            for position, found in _split(sequence, tables):
+                yield start + position, found
+
+
+def find_emojis(messages):
+    """Returns (message positions, emojis) of every emoji sequence in `messages`.
+
+    Messages with non-ASCII characters are joined and scanned in a single pass,
+    the match offsets are then mapped back to their messages.
+    """
+    messages = pd.Series(messages, dtype=object).reset_index(drop=True)
+    candidates = np.flatnonzero(~messages.map(str.isascii).to_numpy(dtype=bool))
+    texts = messages.iloc[candidates].tolist()
+    if not texts:
+        return np.array([], dtype=np.int64), []
+
+    lengths = np.fromiter((len(text) + 1 for text in texts), dtype=np.int64, count=len(texts))
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    starts = []
+    found = []
+    for position, sequence in _scan('\n'.join(texts)):
+        starts.append(position)
+        found.append(sequence)
+
+    positions = candidates[np.searchsorted(offsets, starts, side='right') - 1] if starts else np.array([], dtype=np.int64)
+    return positions, found
+
+
+class EmojiTable:
+    """Every emoji sequence of a chat: `message_ids` (row position) and `emoji_ids` (position in `vocab`)."""
+
+    def __init__(self, df):
+        self.rows = len(df)
+        message_ids, found = find_emojis(df['message'])
+        emoji_ids, self.vocab = pd.factorize(np.array(found, dtype=object))
+        self.message_ids = message_ids.astype(np.int32)
+        self.emoji_ids = emoji_ids.astype(np.int32)
+
+    def counts(self, positions=None):
+        """Returns the emoji counts of the messages at `positions` (all by default), most used first."""
+        emoji_ids = self.emoji_ids
+        if positions is not None:
+            selected = np.zeros(self.rows, dtype=bool)
+            selected[positions] = True
+            emoji_ids = emoji_ids[selected[self.message_ids]]
+        counts = np.bincount(emoji_ids, minlength=len(self.vocab))
+        order = np.argsort(-counts, kind='stable')
+        order = order[counts[order] > 0]
+        return pd.Series(counts[order], index=self.vocab[order], dtype=np.int64)
+
+    def counts_by(self, df, by):
+        """Returns emoji counts per value of the `by` column(s), e.g. 'user' or 'only_date'."""
+        keys = df[by].iloc[self.message_ids].reset_index(drop=True)
+        table = pd.DataFrame(keys) if isinstance(keys, pd.DataFrame) else keys.to_frame()
+        table['emoji'] = self.vocab[self.emoji_ids]
+        return table.groupby(list(table.columns), observed=True).size().rename('count')
+
+
+def get_emojis(df):
+    """Returns the EmojiTable of `df`, building it on first use."""
+    return cache.per_chat(df, 'emojis', EmojiTable)
@@ -1,234 +1,261 @@
+import numpy as np
 import pandas as pd
-from urlextract import URLExtract
-from wordcloud import WordCloud
 import re
-from collections import Counter
-import emoji
-from textblob import TextBlob
-import string
-import nltk
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.decomposition import LatentDirichletAllocation
-
-# Initialize URL extractor
-extract = URLExtract()
-
-# Download necessary NLTK data (if not already downloaded)
-nltk.download('stopwords', quiet=True)
-nltk.download('vader_lexicon', quiet=True)
+import hashlib
+import cache
+import profiling
+import chat_index
+import activity
+import text_stats
+import links
+import emoji_stats
+import sentiment
+import topics
+import search
 
 # Helper functions
+# Results are memoized per (chat, selected user, arguments), see cache.memoize
+@profiling.instrument
+@cache.memoize
 def fetch_stats(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
+    positions = chat_index.get_index(df).user_positions(selected_user)
+    total_words = text_stats.get_tokens(df).total_words(positions)
+    # Links are counted once per chat, only messages that may hold one go to urlextract
+    num_links = int(links.get_link_counts(df)[positions].sum())
+    df = chat_index.user_rows(selected_user, df)
 
     num_messages = df.shape[0]
-    words = []
-    for message in df['message']:
-        words.extend(message.split())
-    
     num_media_messages = df[df['is_media'] == True].shape[0]
-    links = []
-    for message in df['message']:
-        links.extend(extract.find_urls(message))
-    
-    num_links = len(links)
-    total_words = len(words)
     
     return num_messages, total_words, num_media_messages, num_links
 
+@profiling.instrument
+@cache.memoize
 def most_busy_users(df):
     x = df['user'].value_counts().head()
     df_user = round((df['user'].value_counts() / df.shape[0]) * 100, 2).reset_index().rename(columns={'index': 'name', 'user': 'percent'})
     return x, df_user
 
-def monthly_timeline(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
+@profiling.instrument
+@cache.memoize
+def media_breakdown(selected_user, df):
+    """Media shared per user and type with their total bytes, for chats parsed from a zip export.
 
-    timeline = df.groupby(['year', 'month_num', 'month']).count()['message'].reset_index()
-    time = []
-    for i in range(timeline.shape[0]):
-        time.append(timeline['month'][i] + "-" + str(timeline['year'][i]))
-    timeline['time'] = time
-    
-    return timeline
+    Returns an empty frame for exports without media (no media_type column).
+    """
+    columns = ['user', 'type', 'files', 'bytes']
+    if 'media_type' not in df.columns:
+        return pd.DataFrame(columns=columns)
+    index = chat_index.get_index(df)
+    positions = np.intersect1d(index.user_positions(selected_user), index.media)
+    media = df.iloc[positions]
+    breakdown = (media.groupby(['user', 'media_type'], observed=True)['media_bytes'].agg(['size', 'sum'])
+                 .reset_index())
+    breakdown.columns = columns
+    return breakdown.sort_values(['user', 'bytes'], ascending=[True, False], ignore_index=True)
 
-def daily_timeline(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
+# Timelines and activity maps are roll-ups of the chat's count cube, see activity.ActivityCube
+@profiling.instrument
+@cache.memoize
+def monthly_timeline(selected_user, df):
+    return activity.get_activity(df).monthly_timeline(selected_user)
 
-    daily_timeline = df.groupby('only_date').count()['message'].reset_index()
-    
-    return daily_timeline
+@profiling.instrument
+@cache.memoize
+def daily_timeline(selected_user, df):
+    return activity.get_activity(df).daily_timeline(selected_user)
 
+@profiling.instrument
+@cache.memoize
 def week_activity_map(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-        
-    return df['day_name'].value_counts()
+    # Monday to Sunday
+    return activity.get_activity(df).week_activity_map(selected_user)
 
+@profiling.instrument
+@cache.memoize
 def month_activity_map(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-        
-    return df['month'].value_counts()
+    # January to December
+    return activity.get_activity(df).month_activity_map(selected_user)
 
+@profiling.instrument
+@cache.memoize
 def activity_heatmap(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-    
-    user_heatmap = df.pivot_table(index='day_name', columns='period', values='message', aggfunc='count').fillna(0)
-    
-    return user_heatmap
+    return activity.get_activity(df).activity_heatmap(selected_user)
 
-def create_wordcloud(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
+@profiling.instrument
+@cache.memoize
+def word_frequencies(selected_user, df, max_words=200):
+    """Returns {word: count} of the `max_words` most common words, as counted for most_common_words."""
+    counts = text_stats.get_tokens(df).word_counts(selected_user).head(max_words)
+    return dict(zip(counts.index, counts.to_numpy().tolist()))
 
-    wc = WordCloud(width=500, height=500, min_font_size=10, background_color='white')
-    df_wc = wc.generate(df['message'].str.cat(sep=" "))
-    
-    return df_wc
+@profiling.instrument
+def create_wordcloud(selected_user, df, width=500, height=500, colormap=None, preview=False):
+    """Returns the word cloud of the most common words as an RGB image array.
+
+    Drawn from the word frequencies, so media placeholders and stop words are left
+    out. `preview` lays out fewer words on a canvas of half the size, which is much
+    faster. Images are cached by (frequencies, size, colormap).
+    """
+    max_words = 100 if preview else 200
+    frequencies = word_frequencies(selected_user, df, max_words)
+    if preview:
+        width, height = width // 2, height // 2
+    digest = hashlib.blake2b(repr(sorted(frequencies.items())).encode('utf-8'), digest_size=16).hexdigest()
+    key = (digest, width, height, colormap)
+
+    found, image = cache.images.get(key)
+    profiling.note_cache(found)
+    if not found:
+        from wordcloud import WordCloud
+        wc = WordCloud(width=width, height=height, min_font_size=5 if preview else 10, max_words=max_words,
+                       background_color='white', colormap=colormap, random_state=42)
+        if frequencies:
+            image = wc.generate_from_frequencies(frequencies).to_array()
+        else:
+            # No words to draw: a blank image rather than WordCloud's error
+            image = np.full((height, width, 3), 255, dtype=np.uint8)
+        cache.images.put(key, image)
+    return image
 
 def remove_stop_words(message):
     y = []
-    stopwords = nltk.corpus.stopwords.words('english')
     for word in message.lower().split():
-        if word not in stopwords and word not in string.punctuation:
+        if word not in text_stats.STOPWORDS and word not in text_stats.PUNCTUATION:
             y.append(word)
     return " ".join(y)
 
+@profiling.instrument
+@cache.memoize
 def most_common_words(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-    
-    temp = df[df['user'] != 'group_notification']
-    temp = temp[temp['is_media'] == False]
-    
-    words = []
-    for message in temp['message']:
-        words.extend(message.split())
-
-    stop_words = nltk.corpus.stopwords.words('english')
-    
-    words_filtered = [word.lower() for word in words if word.lower() not in stop_words and word.lower() != '<media' and word.lower() != 'omitted>']
+    # Text messages only, without stop words, counted from the shared token table
+    counts = text_stats.get_tokens(df).word_counts(selected_user).head(20)
     
-    most_common_df = pd.DataFrame(Counter(words_filtered).most_common(20))
-    
-    most_common_df.columns = ['Word', 'Count']
+    most_common_df = pd.DataFrame({'Word': counts.index, 'Count': counts.to_numpy()})
     
     return most_common_df
 
+@profiling.instrument
+@cache.memoize
 def emoji_helper(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
+    # Whole emoji sequences (ZWJ, skin tones, flags) from the chat's emoji table
+    positions = chat_index.get_index(df).user_positions(selected_user)
+    counts = emoji_stats.get_emojis(df).counts(positions)
 
-    emojis = []
-    for message in df['message']:
-        emojis.extend([c for c in message if c in emoji.EMOJI_DATA])
-    
-    emoji_df = pd.DataFrame(Counter(emojis).most_common(len(emojis)))
-    emoji_df.columns = ['emoji', 'count']
+    emoji_df = pd.DataFrame({'emoji': counts.index, 'count': counts.to_numpy()})
     
     return emoji_df
 
-def sentiment_analysis(selected_user, df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-
-    sentiments = []
-    for message in df['message']:
-        blob = TextBlob(message)
-        if blob.sentiment.polarity > 0.1:
-            sentiments.append('Positive')
-        elif blob.sentiment.polarity < -0.1:
-            sentiments.append('Negative')
-        else:
-            sentiments.append('Neutral')
+@profiling.instrument
+@cache.memoize
+def sentiment_analysis(selected_user, df, backend='textblob', workers=None):
+    # Every distinct message of the chat is scored once per backend, users are slices of it
+    positions = chat_index.get_index(df).user_positions(selected_user)
+    scores = sentiment.get_scores(df, backend, workers)[positions]
+    df = df.iloc[positions]
             
-    sentiment_df = pd.DataFrame({'message': df['message'], 'sentiment': sentiments})
+    sentiment_df = pd.DataFrame({'message': df['message'], 'sentiment': sentiment.label(scores, backend),
+                                 'polarity': scores}, index=df.index)
     
     return sentiment_df
 
 # === START OF ADDED FUNCTIONS ===
 
-def response_time_analysis(selected_user, df):
-    """Calculates average response time between users."""
-    if selected_user == 'Overall':
-        temp_df = df[df['user'] != 'group_notification'].copy()
-        temp_df['prev_user'] = temp_df['user'].shift(1)
-        temp_df['prev_date'] = temp_df['date'].shift(1)
-        
-        response_times = []
-        for i, row in temp_df.iterrows():
-            if i > 0 and row['user'] != row['prev_user']:
-                time_diff = (row['date'] - row['prev_date']).total_seconds() / 60
-                if time_diff > 0:
-                    response_times.append({
-                        'user': row['user'],
-                        'response_time_minutes': time_diff
-                    })
-        
-        if not response_times:
-            return pd.DataFrame(), pd.DataFrame()
-            
-        response_df = pd.DataFrame(response_times)
-        avg_response_by_user = response_df.groupby('user')['response_time_minutes'].mean().reset_index()
-        avg_response_by_user.columns = ['User', 'Avg Response Time (min)']
-        return response_df, avg_response_by_user
-    else:
+def _response_stats(response_df, by, label):
+    times = response_df.groupby(by, observed=True)['response_time_minutes']
+    stats = times.agg(['mean', 'median', 'count'])
+    stats.insert(2, 'p90', times.quantile(0.9))
+    stats = stats.reset_index()
+    stats.columns = [label, 'Avg Response Time (min)', 'Median (min)', 'P90 (min)', 'Responses']
+    return stats
+
+@profiling.instrument
+@cache.memoize
+def response_time_analysis(selected_user, df, session_gap_minutes=None):
+    """Calculates response times between users.
+
+    A response is a message following one from another user. Gaps longer than
+    `session_gap_minutes` start a new conversation and are not counted. For
+    'Overall' the stats are per responding user, for one user they are per user
+    they replied to.
+    """
+    temp_df = df[df['user'] != 'group_notification']
+    # One pass over the int64 timestamps and user codes, previous message by shifting
+    times = temp_df['date'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    users, user_names = pd.factorize(temp_df['user'])
+    minutes = (times[1:] - times[:-1]) / 60e9
+    is_response = (users[1:] != users[:-1]) & (minutes > 0)
+    if session_gap_minutes is not None:
+        is_response &= minutes <= session_gap_minutes
+    if selected_user != 'Overall':
+        is_response &= users[1:] == user_names.get_indexer([selected_user])[0]
+
+    rows = np.flatnonzero(is_response)
+    if len(rows) == 0:
         return pd.DataFrame(), pd.DataFrame()
 
+    response_df = pd.DataFrame({
+        'user': user_names.take(users[rows + 1]),
+        'replied_to': user_names.take(users[rows]),
+        'date': temp_df['date'].to_numpy()[rows + 1],
+        'response_time_minutes': minutes[rows],
+    })
+    if selected_user == 'Overall':
+        return response_df, _response_stats(response_df, 'user', 'User')
+    return response_df, _response_stats(response_df, 'replied_to', 'Replied To')
+
+@profiling.instrument
+@cache.memoize
 def message_length_analysis(selected_user, df):
     """Analyzes message length and word count per user."""
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-    
+    words_per_message = text_stats.get_tokens(df).words_per_message
+    positions = chat_index.get_index(df).user_positions(selected_user)
+    df = df.iloc[positions]
+
     temp_df = df[df['user'] != 'group_notification'].copy()
-    temp_df['message_length'] = temp_df['message'].apply(lambda x: len(x))
-    temp_df['word_count'] = temp_df['message'].apply(lambda x: len(x.split()))
+    temp_df['message_length'] = temp_df['message'].str.len()
+    temp_df['word_count'] = words_per_message[positions][(df['user'] != 'group_notification').to_numpy()]
     
-    avg_length_stats = temp_df.groupby('user')[['message_length', 'word_count']].mean().reset_index()
+    avg_length_stats = temp_df.groupby('user', observed=True)[['message_length', 'word_count']].mean().reset_index()
     avg_length_stats.columns = ['User', 'Avg Message Length', 'Avg Word Count']
     
     return temp_df, avg_length_stats
 
-def topic_modeling(selected_user, df):
-    """Performs Topic Modeling using LDA on chat messages."""
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-    
-    temp_df = df[(df['user'] != 'group_notification') & (df['is_media'] == False)].copy()
+@profiling.instrument
+@cache.memoize
+def topic_modeling(selected_user, df, n_topics=5, iterations=5, method='lda', sample_size=topics.SAMPLE_SIZE):
+    """Finds the main topics of the chat messages with online LDA or minibatch NMF.
+
+    The document-term matrix is built once per chat and sliced per user. Selections
+    larger than `sample_size` messages are fitted on a random sample of them.
+    """
+    positions = chat_index.get_index(df).user_positions(selected_user, messages_only=True)
     
-    if len(temp_df) < 10:
+    if len(positions) < 10:
         return None, None
     
-    # Preprocess text
-    stop_words = nltk.corpus.stopwords.words('english')
-    stop_words.extend(['media', 'omitted', 'deleted', 'this', 'that', 'with', 'from', 'for'])
-    
-    temp_df['cleaned_message'] = temp_df['message'].apply(lambda x: ' '.join([word.lower() for word in str(x).split() if word.lower() not in stop_words and len(word)>2]))
-    
-    # TF-IDF Vectorizer
-    vectorizer = TfidfVectorizer(max_df=0.95, min_df=2, stop_words=stop_words)
-    try:
-        tfidf_matrix = vectorizer.fit_transform(temp_df['cleaned_message'])
-    except ValueError:
-        return [], None
-        
-    # LDA model
-    lda = LatentDirichletAllocation(n_components=5, random_state=42)
-    lda.fit(tfidf_matrix)
+    return topics.fit_topics(positions, df, n_topics, method, iterations, sample_size)
+
+@profiling.instrument
+@cache.memoize
+def topic_drift(selected_user, df, window='Q', n_topics=5, method='lda'):
+    """Topics after every time window ('M', 'Q' or 'Y'), from one model updated window by window."""
+    positions = chat_index.get_index(df).user_positions(selected_user, messages_only=True)
     
-    feature_names = vectorizer.get_feature_names_out()
+    if len(positions) < 10:
+        return pd.DataFrame(columns=['window', 'topic_id', 'words', 'messages'])
     
-    topics_list = []
-    for topic_idx, topic in enumerate(lda.components_):
-        top_words = [feature_names[i] for i in topic.argsort()[:-6:-1]]
-        topics_list.append({
-            'topic_id': topic_idx,
-            'words': top_words
-        })
-        
-    return topics_list, lda
\ No newline at end of file
+    return topics.topics_over_time(positions, df, window, n_topics, method)
+
+@profiling.instrument
+@cache.memoize
+def search_messages(selected_user, df, query, start=None, end=None, limit=100):
+    """Messages holding every word and "quoted phrase" of `query`, from the chat's inverted index.
+
+    `start` and `end` (excluded) bound the dates. Returns (hits, messages, timeline):
+    the number of matching messages, the `limit` latest of them and the hits per month.
+    """
+    index = search.get_search_index(df)
+    ids = index.search(query, selected_user, start, end)
+    messages = df.iloc[ids[::-1][:limit]][['date', 'user', 'message']].reset_index(drop=True)
+    return len(ids), messages, index.timeline(ids)
@@ -0,0 +1,266 @@
+"""Incremental analysis of chats that are exported again and again.
+
+Each export of a chat is a superset of the previous one. IncrementalChat keeps the
+aggregates behind the dashboard (counts, word and emoji counters, timelines, the
+heatmap and response-time sums) and, given a later export, only parses the bytes
+after the part it has already seen.
+
+Usage: python incremental.py STATE_DIR EXPORT [EXPORT ...]
+"""
+import os
+import sys
+import math
+import pickle
+import hashlib
+import argparse
+from collections import Counter, defaultdict
+import numpy as np
+import pandas as pd
+import preprocessor
+import text_stats
+import emoji_stats
+import links
+
+# The first line of an export (up to this many bytes) identifies the chat
+HEADER_BYTES = 4096
+# Bytes at the end of the processed part that must be found again in a later export
+TAIL_BYTES = 64 * 1024
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def header_key(data):
+    """Returns the identifier shared by every export of the same chat: the digest of its first line.
+
+    Whole leading blocks would not do, a first export shorter than the block has
+    different leading bytes than the later ones.
+    """
+    return _digest(data[:HEADER_BYTES].split(b'\n', 1)[0])
+
+
+class IncrementalChat:
+    """Aggregates of one chat, updated in place with the new tail of each export."""
+
+    def __init__(self):
+        self.header = None
+        self.length = 0
+        self.tail = None
+        self.rows = 0
+        # Export layout detected on the first export, new tails are parsed with it
+        self.layout = None
+
+        self.messages = Counter()
+        self.words = Counter()
+        self.media = Counter()
+        self.links = Counter()
+        self.word_counts = defaultdict(Counter)
+        self.emoji_counts = defaultdict(Counter)
+        # Keyed by (user, year, month_num), (user, only_date) and (user, day_name, period)
+        self.monthly = Counter()
+        self.daily = Counter()
+        self.heatmap = Counter()
+        # Per responding user: [responses, total minutes], and the last message seen
+        self.responses = defaultdict(lambda: [0, 0.0])
+        self.last_message = None
+
+    def _tail_digest(self, data, length):
+        return _digest(data[max(0, length - TAIL_BYTES):length])
+
+    def extends(self, data):
+        """Tells whether `data` starts with the part of the chat processed so far."""
+        return (self.header is not None and len(data) >= self.length
+                and header_key(data) == self.header
+                and self._tail_digest(data, self.length) == self.tail)
+
+    def update(self, data):
+        """Adds an export of the chat and returns the number of new messages.
+
+        When `data` extends the exports seen so far only its new tail is parsed,
+        otherwise the aggregates are rebuilt from scratch.
+        """
+        data = bytes(data)
+        if self.extends(data):
+            # A short tail can fit both d/m and m/d dates, it is not detected again
+            df = preprocessor.preprocess(data[self.length:], layout=self.layout)
+        else:
+            self.__init__()
+            self.header = header_key(data)
+            df = preprocessor.preprocess(data)
+            self.layout = df.attrs['parse_stats']['layout']
+
+        self._add(df)
+        self.length = len(data)
+        self.tail = self._tail_digest(data, self.length)
+        return len(df)
+
+    def _add(self, df):
+        if df.empty:
+            return
+        self.rows += len(df)
+        users = df['user'].astype(object).to_numpy()
+
+        self.messages.update(pd.Series(users).value_counts().to_dict())
+        self.media.update(df.groupby(users)['is_media'].sum().to_dict())
+
+        tokens = text_stats.TokenTable(df)
+        self.words.update(pd.Series(tokens.words_per_message).groupby(users).sum().to_dict())
+        for (user_id, token_id), count in tokens.user_word_counts().items():
+            self.word_counts[tokens.users[user_id]][tokens.vocab[token_id]] += int(count)
+
+        self.links.update(pd.Series(links.count_links(df['message'])).groupby(users).sum().to_dict())
+        for (user, emoji), count in emoji_stats.EmojiTable(df).counts_by(df, 'user').items():
+            self.emoji_counts[user][emoji] += int(count)
+
+        calendar = {name: preprocessor.calendar_column(df, name)
+                    for name in ('year', 'month_num', 'only_date', 'day_name', 'period')}
+        self.monthly.update(df.groupby([df['user'], calendar['year'], calendar['month_num']],
+                                       observed=True).size().to_dict())
+        self.daily.update(df.groupby([df['user'], calendar['only_date']], observed=True).size().to_dict())
+        self.heatmap.update(df.groupby([df['user'], calendar['day_name'], calendar['period']],
+                                       observed=True).size().to_dict())
+
+        self._add_responses(df)
+
+    def _add_responses(self, df):
+        # Same rule as helper.response_time_analysis, chained to the last message
+        # of the previous export
+        temp_df = df[df['user'] != 'group_notification']
+        if temp_df.empty:
+            return
+        times = temp_df['date'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        users = temp_df['user'].astype(object).to_numpy()
+        if self.last_message is not None:
+            times = np.concatenate(([self.last_message[1]], times))
+            users = np.concatenate(([self.last_message[0]], users))
+
+        minutes = (times[1:] - times[:-1]) / 60e9
+        is_response = (users[1:] != users[:-1]) & (minutes > 0)
+        responders = pd.Series(minutes[is_response]).groupby(users[1:][is_response])
+        for user, (count, total) in responders.agg(['count', 'sum']).iterrows():
+            self.responses[user][0] += int(count)
+            self.responses[user][1] += total
+        self.last_message = (users[-1], int(times[-1]))
+
+    # Views, in the shapes returned by the helper.py functions
+
+    def _by_user(self, counter, selected_user):
+        # Drops the user from keys (user, ...), summing over users for 'Overall'
+        result = Counter()
+        for key, count in counter.items():
+            if selected_user == 'Overall' or key[0] == selected_user:
+                result[key[1:] if len(key) > 2 else key[1]] += count
+        return result
+
+    def fetch_stats(self, selected_user):
+        def total(counter):
+            return int(sum(counter.values()) if selected_user == 'Overall' else counter[selected_user])
+        return total(self.messages), total(self.words), total(self.media), total(self.links)
+
+    def monthly_timeline(self, selected_user):
+        counts = self._by_user(self.monthly, selected_user)
+        timeline = pd.DataFrame([(year, month_num, preprocessor.MONTHS[month_num - 1], count)
+                                 for (year, month_num), count in sorted(counts.items())],
+                                columns=['year', 'month_num', 'month', 'message'])
+        timeline['time'] = timeline['month'] + "-" + timeline['year'].astype(str)
+        return timeline
+
+    def daily_timeline(self, selected_user):
+        counts = self._by_user(self.daily, selected_user)
+        return pd.DataFrame(sorted(counts.items()), columns=['only_date', 'message'])
+
+    def activity_heatmap(self, selected_user):
+        counts = pd.Series(self._by_user(self.heatmap, selected_user), dtype=np.int64)
+        if counts.empty:
+            return pd.DataFrame()
+        heatmap = counts.unstack(fill_value=0).astype(float)
+        return heatmap.reindex(index=[day for day in preprocessor.DAYS if day in heatmap.index],
+                               columns=[period for period in preprocessor.PERIODS if period in heatmap.columns])
+
+    def most_common_words(self, selected_user, n=20):
+        counts = Counter()
+        for user, words in self.word_counts.items():
+            if selected_user in ('Overall', user):
+                counts.update(words)
+        return pd.DataFrame(counts.most_common(n), columns=['Word', 'Count'])
+
+    def emoji_helper(self, selected_user):
+        counts = Counter()
+        for user, emojis in self.emoji_counts.items():
+            if selected_user in ('Overall', user):
+                counts.update(emojis)
+        return pd.DataFrame(counts.most_common(), columns=['emoji', 'count'])
+
+    def average_response_times(self):
+        return pd.DataFrame([(user, total / count) for user, (count, total) in sorted(self.responses.items())],
+                            columns=['User', 'Avg Response Time (min)'])
+
+    def save(self, path):
+        state = dict(vars(self), responses=dict(self.responses))
+        with open(path, 'wb') as f:
+            pickle.dump(state, f)
+
+    @classmethod
+    def load(cls, path):
+        chat = cls()
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        responses = state.pop('responses')
+        vars(chat).update(state)
+        chat.responses.update(responses)
+        return chat
+
+
+    def differences(self, other):
+        """Returns the names of the aggregates that differ from those of `other`."""
+        names = ['rows', 'messages', 'words', 'media', 'links', 'word_counts', 'emoji_counts', 'monthly', 'daily',
+                 'heatmap']
+        different = [name for name in names if getattr(self, name) != getattr(other, name)]
+        # Response minutes are float sums, added up in another order by an incremental update
+        if (self.responses.keys() != other.responses.keys()
+                or any(count != other.responses[user][0] or not math.isclose(total, other.responses[user][1])
+                       for user, (count, total) in self.responses.items())):
+            different.append('responses')
+        return different
+
+
+def update_from_file(state_dir, path):
+    """Adds the export at `path` to the stored state of its chat and returns (chat, new messages)."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    state_path = os.path.join(state_dir, header_key(data) + '.pkl')
+    chat = IncrementalChat.load(state_path) if os.path.exists(state_path) else IncrementalChat()
+    new_messages = chat.update(data)
+    chat.save(state_path)
+    return chat, new_messages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('state_dir', help="directory keeping one state file per chat")
+    parser.add_argument('exports', nargs='+', help="exported .txt files")
+    parser.add_argument('--check', action='store_true',
+                        help="also parse every export in full and report aggregates that differ")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.state_dir, exist_ok=True)
+    mismatches = 0
+    for path in args.exports:
+        chat, new_messages = update_from_file(args.state_dir, path)
+        num_messages, total_words, num_media, num_links = chat.fetch_stats('Overall')
+        print("%s: %d new messages, %d in total, %d words, %d media, %d links"
+              % (path, new_messages, num_messages, total_words, num_media, num_links))
+        if args.check:
+            full = IncrementalChat()
+            with open(path, 'rb') as f:
+                full.update(f.read())
+            different = chat.differences(full)
+            if different:
+                mismatches += 1
+                print("%s: differs from a full parse in %s" % (path, ', '.join(different)))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
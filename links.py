@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import functools
+import cache
+
+# Cheap test every URL found by urlextract passes: a scheme, "www.", a dot followed
+# by something that could be a TLD or an IPv4 address. Messages failing it are never
+# sent to urlextract.
+URL_CANDIDATE = r'://|www\.|\.[^\W\d_]{2,}|\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}'
+
+# Number of candidate messages joined into one urlextract call
+BATCH_SIZE = 2000
+
+
+@functools.lru_cache(maxsize=None)
+def get_extractor():
+    """Returns the shared URLExtract, created on first use since it loads the TLD list."""
+    from urlextract import URLExtract
+    return URLExtract()
+
+
+def count_links(messages, batch_size=BATCH_SIZE):
+    """Returns the number of URLs in each message, as found by URLExtract.find_urls."""
+    messages = pd.Series(messages, dtype=object).reset_index(drop=True)
+    counts = np.zeros(len(messages), dtype=np.int32)
+    candidates = np.flatnonzero(messages.str.contains(URL_CANDIDATE, regex=True).to_numpy(dtype=bool))
+    if len(candidates):
+        extract = get_extractor()
+
+    for start in range(0, len(candidates), batch_size):
+        batch = candidates[start:start + batch_size]
+        texts = messages.iloc[batch].tolist()
+        # Newlines stop a URL, so the joined text finds the same URLs as each message alone
+        lengths = np.fromiter((len(text) + 1 for text in texts), dtype=np.int64, count=len(texts))
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        starts = [span[0] for _, span in extract.gen_urls('\n'.join(texts), get_indices=True)]
+        if starts:
+            owners = np.searchsorted(offsets, starts, side='right') - 1
+            np.add.at(counts, batch[owners], 1)
+
+    return counts
+
+
+def get_link_counts(df):
+    """Returns the number of links in every message of `df`, counted once per chat."""
+    return cache.per_chat(df, 'link_counts', lambda df: count_links(df['message']))
+
+
+def link_stats(df, by='user'):
+    """Returns the number of links shared per user ('user') or per day ('only_date')."""
+    return pd.Series(get_link_counts(df), index=df.index).groupby(df[by], observed=True).sum()
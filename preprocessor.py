@@ -1,55 +1,389 @@
+import io
+import os
 import re
+import time
+import logging
+from collections import Counter, namedtuple
+from itertools import chain, islice
+import numpy as np
 import pandas as pd
+import profiling
 
-def preprocess(data):
-    pattern = r'(\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\u202f[ap]m)\s-\s(.*)'
-    matches = re.findall(pattern, data)
-    
-    messages = [match[1] for match in matches]
-    dates = [match[0] for match in matches]
+logger = logging.getLogger(__name__)
 
-    df = pd.DataFrame({'user_message': messages, 'message_date': dates})
-    # convert message_date type
-    df['message_date'] = pd.to_datetime(df['message_date'], format='%d/%m/%y, %I:%M\u202f%p')
+# An export layout: `header` matches a line that starts a new message and captures
+# the timestamp and "<user>: <message>", `date_format` parses the captured timestamp.
+Layout = namedtuple('Layout', ['name', 'header', 'date_format'])
 
-    df.rename(columns={'message_date': 'date'}, inplace=True)
 
-    users = []
-    messages = []
-    for message in df['user_message']:
-        entry = re.split(r'([\w\W]+?):\s', message)
-        if entry[1:]:  # user name
-            users.append(entry[1])
-            messages.append(" ".join(entry[2:]))
+def _build_layouts():
+    layouts = []
+    for platform in ('android', 'ios'):
+        # iOS exports are "[<date>, <time>] <user>: <message>" and include seconds
+        seconds_re, seconds_format = (r':\d{2}', ':%S') if platform == 'ios' else ('', '')
+        for years in ('yy', 'yyyy'):
+            date_re = r'\d{1,2}/\d{1,2}/\d{%d}' % len(years)
+            year_format = '%y' if years == 'yy' else '%Y'
+            for clock, space in (('12h-narrow', '\u202f'), ('12h', ' '), ('24h', None)):
+                if space is None:
+                    time_re = r'\d{1,2}:\d{2}' + seconds_re
+                    time_format = '%H:%M' + seconds_format
+                else:
+                    time_re = r'\d{1,2}:\d{2}' + seconds_re + space + '[aApP][mM]'
+                    time_format = '%I:%M' + seconds_format + space + '%p'
+                if platform == 'ios':
+                    header = r'\u200e?\[(%s,\s%s)\]\s(.*)' % (date_re, time_re)
+                else:
+                    header = r'(%s,\s%s)\s-\s(.*)' % (date_re, time_re)
+                for order, day_month in (('dmy', '%d/%m'), ('mdy', '%m/%d')):
+                    name = '-'.join([platform, order, years, clock])
+                    date_format = day_month + '/' + year_format + ', ' + time_format
+                    layouts.append(Layout(name, re.compile(header), date_format))
+    return layouts
+
+
+# Known WhatsApp export layouts. The first one is the default for files nothing matches.
+LAYOUTS = _build_layouts()
+
+# Number of lines at the top of the export used to pick the layout
+SAMPLE_LINES = 500
+
+# First characters of any known header, lines starting otherwise are never headers
+HEADER_START = frozenset('0123456789[\u200e')
+
+# Number of messages parsed together before they are appended to the columns
+CHUNK_SIZE = 50000
+
+
+def _iter_text_lines(text):
+    # Walk the string without splitlines() so no second copy of the export is built
+    start = 0
+    end = len(text)
+    while start < end:
+        stop = text.find('\n', start)
+        if stop == -1:
+            stop = end
+        yield text[start:stop].rstrip('\r')
+        start = stop + 1
+
+
+def _iter_stream_lines(stream):
+    if isinstance(stream.read(0), bytes):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig')
+        try:
+            for line in stream:
+                yield line.rstrip('\r\n')
+        finally:
+            # Don't close the caller's stream along with the wrapper
+            stream.detach()
+    else:
+        for line in stream:
+            yield line.rstrip('\r\n')
+
+
+def iter_lines(source):
+    """Yields the lines of an export given as text, bytes, a file path or a file-like object."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield from _iter_stream_lines(io.BytesIO(source))
+    elif isinstance(source, str):
+        if '\n' not in source and os.path.isfile(source):
+            with open(source, 'rb') as f:
+                yield from _iter_stream_lines(f)
         else:
-            users.append('group_notification')
-            messages.append(entry[0])
-
-    df['user'] = users
-    df['message'] = messages
-    df.drop(columns=['user_message'], inplace=True)
-
-    # Add the column to calculate media messages
-    df['is_media'] = df['message'] == '<Media omitted>'
-
-    df['only_date'] = df['date'].dt.date
-    df['year'] = df['date'].dt.year
-    df['month_num'] = df['date'].dt.month
-    df['month'] = df['date'].dt.month_name()
-    df['day'] = df['date'].dt.day
-    df['day_name'] = df['date'].dt.day_name()
-    df['hour'] = df['date'].dt.hour
-    df['minute'] = df['date'].dt.minute
-
-    period = []
-    for hour in df[['day_name', 'hour']]['hour']:
-        if hour == 23:
-            period.append(str(hour) + "-" + str('00'))
-        elif hour == 0:
-            period.append(str('00') + "-" + str(hour + 1))
+            yield from _iter_text_lines(source.lstrip('\ufeff'))
+    else:
+        yield from _iter_stream_lines(source)
+
+
+def detect_layouts(sample):
+    """Picks the layout parsing the most headers in `sample`.
+
+    Returns the layout and the fallbacks tried on lines it doesn't match: the best
+    layout for every other header pattern.
+    """
+    best = {}
+    for layout in LAYOUTS:
+        dates = [match.group(1) for match in map(layout.header.match, sample) if match]
+        if dates:
+            parsed = pd.to_datetime(pd.Series(dates, dtype=object), format=layout.date_format, errors='coerce')
+            score = int(parsed.notna().sum())
         else:
-            period.append(str(hour) + "-" + str(hour + 1))
+            score = 0
+        # d/m and m/d layouts share a pattern, keep whichever parses more of the sample
+        pattern = layout.header.pattern
+        if pattern not in best or score > best[pattern][0]:
+            best[pattern] = (score, layout)
+
+    ranked = sorted(best.values(), key=lambda item: -item[0])
+    layout = ranked[0][1] if ranked[0][0] else LAYOUTS[0]
+    fallbacks = [item[1] for item in ranked if item[1] is not layout]
+    return layout, fallbacks
+
+
+def iter_messages(lines, layout=LAYOUTS[0], fallbacks=()):
+    """Yields (date, user_message, layout) triples, attaching continuation lines to the message above them.
+
+    Lines are matched against `layout` first. Only lines it rejects that could still be
+    a header are tried against the `fallbacks`.
+    """
+    header = layout.header.match
+    date = None
+    parts = []
+    current = None
+    for line in lines:
+        kind = layout
+        match = header(line)
+        if match is None and fallbacks and line[:1] in HEADER_START:
+            for kind in fallbacks:
+                match = kind.header.match(line)
+                if match:
+                    break
+        if match:
+            if date is not None:
+                yield date, '\n'.join(parts), current
+            date = match.group(1)
+            parts = [match.group(2)]
+            current = kind
+        elif date is not None:
+            parts.append(line)
+
+    if date is not None:
+        yield date, '\n'.join(parts), current
+
+
+def iter_chunks(source, chunksize=CHUNK_SIZE, stats=None, layout=None):
+    """Yields lists of at most `chunksize` (date, user_message, layout) triples.
+
+    The layout is detected from the first SAMPLE_LINES lines, unless `layout` names
+    it (e.g. the one detected on an earlier export of the same chat). Pass a dict as
+    `stats` to get the layout used back.
+    """
+    lines = iter_lines(source)
+    sample = list(islice(lines, SAMPLE_LINES))
+    detected, fallbacks = detect_layouts(sample)
+    if layout is None:
+        layout = detected
+    else:
+        # A few lines can fit both d/m and m/d, the named layout is kept over its twin
+        layout = next(known for known in LAYOUTS if known.name == layout)
+        fallbacks = [kind for kind in [detected] + fallbacks if kind.header.pattern != layout.header.pattern]
+    if stats is not None:
+        stats['layout'] = layout.name
+
+    chunk = []
+    for item in iter_messages(chain(sample, lines), layout, fallbacks):
+        chunk.append(item)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def twin(layout):
+    """Returns the layout reading the dates of `layout` with day and month swapped."""
+    order = 'mdy' if '-dmy-' in layout.name else 'dmy'
+    name = layout.name.replace('-dmy-', '-' + order + '-').replace('-mdy-', '-' + order + '-')
+    return next(known for known in LAYOUTS if known.name == name)
+
+
+def day_month_order(dates):
+    """Returns 'dmy' or 'mdy' from the first date with a day above 12, None while every date fits both."""
+    for date in dates:
+        first, second = date.split('/', 2)[:2]
+        if int(first) > 12:
+            return 'dmy'
+        if int(second) > 12:
+            return 'mdy'
+    return None
+
+
+def _parse_mixed_dates(dates, kinds, stats):
+    # Slow path for chunks mixing several layouts or with dates the detected format
+    # rejects: each layout's rows are parsed with its own format. Rows that still fail
+    # are left unparsed, never read with day and month swapped one by one.
+    start = time.perf_counter()
+    dates = pd.Series(dates, dtype=object)
+    kinds = pd.Series([kind.name for kind in kinds], dtype=object)
+    parsed = pd.Series(pd.NaT, index=dates.index, dtype='datetime64[ns]')
+    by_name = {layout.name: layout for layout in LAYOUTS}
+
+    for name, rows in kinds.groupby(kinds).groups.items():
+        layout = by_name[name]
+        parsed[rows] = pd.to_datetime(dates[rows], format=layout.date_format, errors='coerce')
+        stats['slow_path_layouts'][name] += len(rows)
+
+    stats['slow_path_messages'] += len(dates)
+    stats['unparsed_dates'] += int(parsed.isna().sum())
+    stats['slow_path_seconds'] += time.perf_counter() - start
+    return parsed.to_numpy()
+
+
+def _parse_dates(dates, kinds, stats):
+    # convert message_date type, with a single exact format unless the chunk mixes layouts
+    layout = kinds[0]
+    if all(kind is layout for kind in kinds):
+        parsed = pd.to_datetime(dates, format=layout.date_format, errors='coerce')
+        if not parsed.hasnans:
+            return parsed.to_numpy()
+    return _parse_mixed_dates(dates, kinds, stats)
+
+
+# "<user>: <message>", anything without the separator is a group notification
+USER_MESSAGE = r'^(?P<user>[\w\W]+?):\s(?P<message>[\w\W]*)$'
+
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+          'August', 'September', 'October', 'November', 'December']
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+# Label of the hour-long period starting at each hour of the day
+PERIODS = [str(hour) + "-" + str(hour + 1) for hour in range(24)]
+PERIODS[0] = '00-1'
+PERIODS[23] = '23-00'
+
+
+# Placeholder of the media of "Without media" exports
+MEDIA_OMITTED = '<Media omitted>'
+# File attached in an "Include media" export: "<attached: NAME>" (iOS) or "NAME (file attached)" (Android)
+ATTACHMENT = r'^\u200e?(?:<attached: (?P<ios>[^>\n]+)>|(?P<android>[^\n]+?) \(file attached\))'
+
+
+def attachment_names(messages):
+    """Returns the name of the file every message says is attached, NaN for the others.
+
+    Any text can read like an attachment, archive.add_media_columns checks the names against the zip.
+    """
+    messages = pd.Series(messages)
+    names = pd.Series(np.nan, index=messages.index, dtype=object)
+    # Only messages mentioning an attachment go through the regex
+    candidates = messages.str.contains('attached', regex=False, na=False).to_numpy()
+    if candidates.any():
+        parts = messages[candidates].str.extract(ATTACHMENT)
+        names[candidates] = parts['ios'].fillna(parts['android']).to_numpy(dtype=object)
+    return names
+
+
+def split_user_messages(user_messages):
+    """Splits raw "<user>: <message>" strings into user and message Series."""
+    user_messages = pd.Series(user_messages, dtype=object)
+    parts = user_messages.str.extract(USER_MESSAGE)
+    is_notification = parts['user'].isna()
+    users = parts['user'].mask(is_notification, 'group_notification')
+    messages = parts['message'].mask(is_notification, user_messages)
+    return users, messages
+
+
+# Calendar columns of the frame, each derived from the `date` accessor
+CALENDAR_COLUMNS = {
+    'only_date': lambda dates: dates.date,
+    'year': lambda dates: dates.year,
+    'month_num': lambda dates: dates.month,
+    'month': lambda dates: pd.Categorical.from_codes(dates.month - 1, categories=MONTHS, ordered=True),
+    'day': lambda dates: dates.day,
+    'day_name': lambda dates: pd.Categorical.from_codes(dates.dayofweek, categories=DAYS, ordered=True),
+    'hour': lambda dates: dates.hour,
+    'minute': lambda dates: dates.minute,
+    'period': lambda dates: pd.Categorical.from_codes(dates.hour, categories=PERIODS),
+}
+
+
+def add_derived_columns(df, calendar=True):
+    """Adds the media flag and, with `calendar`, the calendar columns derived from `date`."""
+    # Add the column to calculate media messages. Attached files only count once they are
+    # found in the archive of the export, see archive.add_media_columns
+    df['is_media'] = (df['message'] == MEDIA_OMITTED).to_numpy(dtype=bool)
+
+    if calendar:
+        dates = df['date'].dt
+        for name, derive in CALENDAR_COLUMNS.items():
+            df[name] = derive(dates)
+
+    return df
+
+
+def calendar_column(df, name):
+    """Returns the calendar column `name` of `df`, derived from `date` when the frame is compact."""
+    if name in df.columns:
+        return df[name]
+    return pd.Series(CALENDAR_COLUMNS[name](df['date'].dt), index=df.index, name=name)
+
+
+def compact(df):
+    """Returns the compact layout of a parsed frame: date, user, message, is_media and media columns.
+
+    Messages become Arrow strings (when pyarrow is installed) and users stay
+    dictionary encoded; the calendar columns are left out, calendar_column()
+    derives them on demand.
+    """
+    df = df.drop(columns=[name for name in CALENDAR_COLUMNS if name in df.columns])
+    try:
+        df['message'] = df['message'].astype('string[pyarrow]')
+    except ImportError:
+        df['message'] = df['message'].astype('string')
+    df.attrs['compact'] = True
+    return df
+
+
+@profiling.instrument
+def preprocess(data, chunksize=CHUNK_SIZE, compact_layout=False, layout=None):
+    # `data` can be the decoded text, the uploaded bytes, a file path or a file-like object.
+    # It is read line by line and the columns are filled one chunk at a time.
+    # `layout` names the export layout instead of detecting it, see iter_chunks.
+    # With `compact_layout` the frame is returned in the smaller layout of compact().
+    stats = {'layout': None, 'messages': 0, 'slow_path_messages': 0, 'slow_path_layouts': Counter(),
+             'slow_path_seconds': 0.0, 'unparsed_dates': 0}
+    dates = []
+    users = []
+    messages = []
+    # Until a day above 12 shows whether dates are d/m or m/d, the chunks read with the
+    # detected layout are kept as text and read again with its twin if it was the wrong one
+    undecided = layout is None
+    detected = swapped = None
+    pending = []
+    for chunk in iter_chunks(data, chunksize, stats, layout):
+        chunk_dates = [item[0] for item in chunk]
+        kinds = [item[2] for item in chunk]
+        if undecided:
+            detected = next(kind for kind in LAYOUTS if kind.name == stats['layout'])
+            order = day_month_order([date for date, kind in zip(chunk_dates, kinds) if kind is detected])
+            if order is None:
+                pending.append((len(dates), chunk_dates, kinds))
+            else:
+                undecided = False
+                if '-%s-' % order not in detected.name:
+                    swapped = twin(detected)
+                    stats['layout'] = swapped.name
+                    for position, pending_dates, pending_kinds in pending:
+                        pending_kinds = [swapped if kind is detected else kind for kind in pending_kinds]
+                        dates[position] = _parse_dates(pending_dates, pending_kinds, stats)
+                pending = []
+        if swapped is not None:
+            kinds = [swapped if kind is detected else kind for kind in kinds]
+        dates.append(_parse_dates(chunk_dates, kinds, stats))
+        chunk_users, chunk_messages = split_user_messages([item[1] for item in chunk])
+        users.append(chunk_users)
+        messages.append(chunk_messages)
+        stats['messages'] += len(chunk)
+    if pending:
+        logger.warning("No day above 12 in the export, its dates were read as %s", stats['layout'])
+
+    if dates:
+        date = np.concatenate(dates)
+        user = pd.concat(users, ignore_index=True)
+        message = pd.concat(messages, ignore_index=True)
+    else:
+        date = np.array([], dtype='datetime64[ns]')
+        user = message = pd.Series([], dtype=object)
 
-    df['period'] = period
+    df = pd.DataFrame({'date': date, 'user': user.astype('category'), 'message': message})
+    if stats['unparsed_dates']:
+        df = df[df['date'].notna()].reset_index(drop=True)
+    if stats['slow_path_messages']:
+        logger.info("Mixed export layouts: %d of %d messages parsed on the slow path in %.3fs (%s)",
+                    stats['slow_path_messages'], stats['messages'], stats['slow_path_seconds'],
+                    dict(stats['slow_path_layouts']))
 
-    return df
\ No newline at end of file
+    df = add_derived_columns(df, calendar=not compact_layout)
+    if compact_layout:
+        df = compact(df)
+    df.attrs['parse_stats'] = stats
+    return df
@@ -0,0 +1,273 @@
+"""Per-call instrumentation of parsing, analyses and chart rendering.
+
+Disabled by default: an instrumented function then costs two flag checks per call.
+Once enabled for the whole process (profiling.enable() or CHAT_PROFILING=1), or
+for the calls of one run (start_run(), e.g. one session's rerun with the
+Performance panel on), every call records its wall time, CPU time, peak memory
+growth (traced with tracemalloc), input rows, whether it was served from the
+result cache and the bytes of chart payloads. Records are tagged with their run.
+"""
+import os
+import time
+import json
+import inspect
+import threading
+import functools
+import itertools
+import contextlib
+import tracemalloc
+from collections import deque, OrderedDict
+
+# Most recent calls kept
+MAX_RECORDS = 10000
+
+_enabled = False
+_records = deque(maxlen=MAX_RECORDS)
+_lock = threading.Lock()
+_local = threading.local()
+
+
+# Runs in progress, and those of them tracing memory: tracemalloc is stopped once none is left
+_runs = set()
+_tracing_runs = set()
+_run_ids = itertools.count(1)
+
+
+def enable(trace_memory=True):
+    """Starts recording every call, with peak memory when `trace_memory` is set (slows Python code down)."""
+    global _enabled
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    with _lock:
+        if tracemalloc.is_tracing() and not _tracing_runs:
+            tracemalloc.stop()
+
+
+def enabled():
+    """Tells whether the calls of this thread are recorded."""
+    return _enabled or current_run() is not None
+
+
+def start_run(trace_memory=True):
+    """Records the calls of this thread (and of the functions passed to bind()) until end_run, returns the run id.
+
+    Other threads are not affected, except that tracemalloc is shared while a run traces memory.
+    """
+    run = next(_run_ids)
+    with _lock:
+        _runs.add(run)
+        if trace_memory:
+            _tracing_runs.add(run)
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+    _local.run = run
+    return run
+
+
+def end_run(run):
+    """Stops the run `run`; calling it again, or from another thread, is harmless."""
+    if getattr(_local, 'run', None) == run:
+        _local.run = None
+    with _lock:
+        _runs.discard(run)
+        _tracing_runs.discard(run)
+        if tracemalloc.is_tracing() and not _tracing_runs and not _enabled:
+            tracemalloc.stop()
+
+
+def current_run():
+    """Returns the run this thread records into, None when there is none or it has ended."""
+    run = getattr(_local, 'run', None)
+    return run if run in _runs else None
+
+
+def bind(func):
+    """Returns `func` recording into the run of the calling thread, for work handed to another thread."""
+    run = current_run()
+    if run is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, 'run', None)
+        _local.run = run
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.run = previous
+
+    return wrapper
+
+
+def reset():
+    with _lock:
+        _records.clear()
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class _Call:
+    # One running call; peaks of nested calls are passed up to the caller since each
+    # call resets the tracemalloc peak when it starts
+    __slots__ = ('name', 'rows', 'cache', 'payload', 'wall', 'cpu', 'memory', 'peak')
+
+    def __init__(self, name, rows):
+        self.name = name
+        self.rows = rows
+        self.cache = None
+        self.payload = None
+
+    def __enter__(self):
+        stack = _stack()
+        self.memory = None
+        self.peak = 0
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.memory = current
+            self.peak = current
+        stack.append(self)
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.thread_time() - self.cpu
+        stack = _stack()
+        stack.pop()
+        peak_delta = None
+        if self.memory is not None and tracemalloc.is_tracing():
+            peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            peak_delta = peak - self.memory
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+        record = {'name': self.name, 'wall_seconds': wall, 'cpu_seconds': cpu, 'peak_memory_bytes': peak_delta,
+                  'rows': self.rows, 'cache': self.cache, 'payload_bytes': self.payload, 'time': time.time(),
+                  'run': current_run()}
+        with _lock:
+            _records.append(record)
+        return False
+
+
+def span(name, rows=None):
+    """Context manager recording the enclosed block as a call named `name`."""
+    if not enabled():
+        return contextlib.nullcontext()
+    return _Call(name, rows)
+
+
+def note_cache(hit):
+    """Marks the innermost running call as served from a cache ('hit') or computed ('miss')."""
+    if enabled():
+        stack = _stack()
+        if stack:
+            stack[-1].cache = 'hit' if hit else 'miss'
+
+
+def note_payload(size):
+    """Adds `size` bytes sent to the browser to the innermost running call."""
+    if enabled():
+        stack = _stack()
+        if stack:
+            stack[-1].payload = (stack[-1].payload or 0) + size
+
+
+def instrument(func):
+    """Records every call of `func`. Its rows are those of its `df` argument, or of the frame it returns."""
+    name = '%s.%s' % (func.__module__, func.__qualname__)
+    parameters = list(inspect.signature(func).parameters)
+    df_position = parameters.index('df') if 'df' in parameters else None
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled and current_run() is None:
+            return func(*args, **kwargs)
+        df = kwargs.get('df')
+        if df is None and df_position is not None and df_position < len(args):
+            df = args[df_position]
+        with _Call(name, len(df) if df is not None else None) as call:
+            result = func(*args, **kwargs)
+            if call.rows is None and hasattr(result, 'shape'):
+                call.rows = result.shape[0]
+        return result
+
+    return wrapper
+
+
+def records(run=None):
+    """Returns the recorded calls, oldest first, only those of `run` when given."""
+    with _lock:
+        return [record for record in _records if run is None or record['run'] == run]
+
+
+def summary(run=None):
+    """Returns one row per instrumented name: calls, cache hits and misses, times, rows, largest peak and payload."""
+    totals = OrderedDict()
+    for record in records(run):
+        total = totals.setdefault(record['name'], {
+            'name': record['name'], 'calls': 0, 'cache_hits': 0, 'cache_misses': 0, 'wall_seconds': 0.0,
+            'cpu_seconds': 0.0, 'max_peak_memory_bytes': None, 'rows': 0, 'payload_bytes': 0})
+        total['calls'] += 1
+        if record['cache'] == 'hit':
+            total['cache_hits'] += 1
+        elif record['cache'] == 'miss':
+            total['cache_misses'] += 1
+        total['wall_seconds'] += record['wall_seconds']
+        total['cpu_seconds'] += record['cpu_seconds']
+        if record['peak_memory_bytes'] is not None:
+            total['max_peak_memory_bytes'] = max(total['max_peak_memory_bytes'] or 0, record['peak_memory_bytes'])
+        total['rows'] += record['rows'] or 0
+        total['payload_bytes'] += record['payload_bytes'] or 0
+    return sorted(totals.values(), key=lambda total: -total['wall_seconds'])
+
+
+def to_json(run=None):
+    return json.dumps({'summary': summary(run), 'calls': records(run)}, indent=1)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def to_prometheus(prefix='chat_analyzer', run=None):
+    """Returns the summary in the Prometheus text exposition format."""
+    metrics = [
+        ('calls_total', 'counter', 'Instrumented calls', lambda total: total['calls']),
+        ('cache_hits_total', 'counter', 'Calls served from the result cache', lambda total: total['cache_hits']),
+        ('cache_misses_total', 'counter', 'Calls computed', lambda total: total['cache_misses']),
+        ('wall_seconds_total', 'counter', 'Wall time of the calls', lambda total: total['wall_seconds']),
+        ('cpu_seconds_total', 'counter', 'CPU time of the calls in their thread', lambda total: total['cpu_seconds']),
+        ('rows_total', 'counter', 'Input rows of the calls', lambda total: total['rows']),
+        ('payload_bytes_total', 'counter', 'Chart payload bytes sent to the browser',
+         lambda total: total['payload_bytes']),
+        ('peak_memory_bytes', 'gauge', 'Largest peak memory growth of one call',
+         lambda total: total['max_peak_memory_bytes']),
+    ]
+    totals = summary(run)
+    lines = []
+    for suffix, kind, description, value in metrics:
+        metric = '%s_%s' % (prefix, suffix)
+        lines.append('# HELP %s %s' % (metric, description))
+        lines.append('# TYPE %s %s' % (metric, kind))
+        for total in totals:
+            if value(total) is not None:
+                lines.append('%s{name="%s"} %s' % (metric, _label(total['name']), repr(float(value(total)))))
+    return '\n'.join(lines) + '\n'
+
+
+if os.environ.get('CHAT_PROFILING') == '1':
+    enable()
@@ -0,0 +1,245 @@
+"""Batch reports over exported chats, without the Streamlit app.
+
+Every export is parsed and analysed in its own worker process and the results are
+written as JSON, CSV or Parquet files under OUT_DIR/<chat>/<user>/, with charts
+rendered as PNG files on request.
+
+Usage: python report.py EXPORT [EXPORT ...] -o OUT_DIR [-a stats,monthly,...]
+       [-u USER] [-f json|csv|parquet] [--charts] [-j WORKERS]
+"""
+import os
+import sys
+import time
+import argparse
+import traceback
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import preprocessor
+import helper
+import archive
+import store
+
+
+def _frame(value, name='value'):
+    if isinstance(value, pd.Series):
+        return value.rename_axis(value.index.name or 'key').reset_index(name=name)
+    return value
+
+
+def _stats(selected_user, df):
+    num_messages, total_words, num_media, num_links = helper.fetch_stats(selected_user, df)
+    tables = {'stats': pd.DataFrame([{'messages': num_messages, 'words': total_words,
+                                      'media': num_media, 'links': num_links}])}
+    media = helper.media_breakdown(selected_user, df)
+    if not media.empty:
+        tables['media'] = media
+    return tables
+
+
+def _busy_users(selected_user, df):
+    counts, percent = helper.most_busy_users(df)
+    return {'busy_users': _frame(counts, 'messages'), 'user_percent': percent}
+
+
+def _heatmap(selected_user, df):
+    # Memoized results are shared, the renamed columns go on a copy
+    heatmap = helper.activity_heatmap(selected_user, df).copy()
+    heatmap.columns = heatmap.columns.astype(str)
+    return {'heatmap': heatmap.reset_index()}
+
+
+def _sentiment(selected_user, df):
+    # Chats already run in parallel, each one is scored in its worker
+    sentiment_df = helper.sentiment_analysis(selected_user, df, workers=1)
+    return {'sentiment': sentiment_df,
+            'sentiment_counts': _frame(sentiment_df['sentiment'].value_counts(), 'messages')}
+
+
+def _responses(selected_user, df):
+    response_df, stats = helper.response_time_analysis(selected_user, df)
+    return {'responses': response_df, 'response_stats': stats}
+
+
+def _lengths(selected_user, df):
+    _, stats = helper.message_length_analysis(selected_user, df)
+    return {'lengths': stats}
+
+
+def _topics(selected_user, df):
+    topics_list, _ = helper.topic_modeling(selected_user, df)
+    return {'topics': pd.DataFrame([{'topic_id': topic['topic_id'], 'words': ' '.join(topic['words'])}
+                                    for topic in topics_list or []], columns=['topic_id', 'words'])}
+
+
+# Analyses by name, each returning its tables by file name
+ANALYSES = OrderedDict([
+    ('stats', _stats),
+    ('busy_users', _busy_users),
+    ('monthly', lambda user, df: {'monthly': helper.monthly_timeline(user, df)}),
+    ('daily', lambda user, df: {'daily': helper.daily_timeline(user, df)}),
+    ('week', lambda user, df: {'week': _frame(helper.week_activity_map(user, df), 'messages')}),
+    ('month', lambda user, df: {'month': _frame(helper.month_activity_map(user, df), 'messages')}),
+    ('heatmap', _heatmap),
+    ('words', lambda user, df: {'words': helper.most_common_words(user, df)}),
+    ('emojis', lambda user, df: {'emojis': helper.emoji_helper(user, df)}),
+    ('sentiment', _sentiment),
+    ('responses', _responses),
+    ('lengths', _lengths),
+    ('topics', _topics),
+])
+# Left out by default: slow on large chats
+DEFAULT_ANALYSES = [name for name in ANALYSES if name not in ('sentiment', 'topics')]
+FORMATS = ('json', 'csv', 'parquet')
+
+
+def write_table(table, path, fmt):
+    if fmt == 'json':
+        table.to_json(path, orient='records', date_format='iso', force_ascii=False, indent=1)
+    elif fmt == 'csv':
+        table.to_csv(path, index=False)
+    else:
+        # Parquet needs string column names and plain columns
+        table = table.copy()
+        table.columns = [str(column) for column in table.columns]
+        for column in table.select_dtypes('category'):
+            table[column] = table[column].astype(str)
+        table.to_parquet(path, index=False)
+
+
+def render_charts(tables, selected_user, df, directory):
+    """Renders the tables that have a chart as PNG files, returns their paths."""
+    # Only imported when charts are requested
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    def bar(table, x, y, name, horizontal=False):
+        fig, ax = plt.subplots(figsize=(10, 5))
+        (ax.barh if horizontal else ax.bar)(table[x].astype(str), table[y])
+        if not horizontal:
+            ax.tick_params(axis='x', rotation=90)
+        return save(fig, name)
+
+    def save(fig, name):
+        path = os.path.join(directory, name + '.png')
+        fig.tight_layout()
+        fig.savefig(path)
+        plt.close(fig)
+        return path
+
+    paths = []
+    if 'monthly' in tables:
+        paths.append(bar(tables['monthly'], 'time', 'message', 'monthly'))
+    if 'daily' in tables:
+        fig, ax = plt.subplots(figsize=(10, 5))
+        ax.plot(tables['daily']['only_date'], tables['daily']['message'])
+        paths.append(save(fig, 'daily'))
+    for name in ('week', 'month', 'busy_users'):
+        if name in tables:
+            table = tables[name]
+            paths.append(bar(table, table.columns[0], table.columns[1], name))
+    if 'words' in tables:
+        paths.append(bar(tables['words'], 'Word', 'Count', 'words', horizontal=True))
+    if 'heatmap' in tables and not tables['heatmap'].empty:
+        heatmap = tables['heatmap'].set_index('day_name')
+        fig, ax = plt.subplots(figsize=(12, 5))
+        image = ax.imshow(heatmap.to_numpy(), aspect='auto')
+        ax.set_yticks(range(len(heatmap.index)), heatmap.index.astype(str))
+        ax.set_xticks(range(len(heatmap.columns)), heatmap.columns, rotation=90)
+        fig.colorbar(image)
+        paths.append(save(fig, 'heatmap'))
+    if 'words' in tables:
+        # The word cloud goes with the most common words
+        fig, ax = plt.subplots(figsize=(6, 6))
+        ax.imshow(helper.create_wordcloud(selected_user, df))
+        ax.axis('off')
+        paths.append(save(fig, 'wordcloud'))
+    return paths
+
+
+def run_chat(path, analyses, users, out_dir, fmt='json', charts=False):
+    """Parses one export and writes its reports. Returns (chat, timings by stage, error)."""
+    chat = store.chat_name(path)
+    timings = OrderedDict()
+
+    def timed(stage, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+    try:
+        if path.lower().endswith('.zip'):
+            # Read and parsed as one stream, the attachments stay compressed in the archive
+            df = timed('parse', archive.parse_zip, path)
+        else:
+            with open(path, 'rb') as f:
+                data = timed('read', f.read)
+            df = timed('parse', preprocessor.preprocess, data)
+        timings['messages'] = len(df)
+
+        for selected_user in users:
+            directory = os.path.join(out_dir, chat, store.chat_name(selected_user))
+            os.makedirs(directory, exist_ok=True)
+            tables = OrderedDict()
+            for name in analyses:
+                tables.update(timed(name, ANALYSES[name], selected_user, df))
+            for name, table in tables.items():
+                timed('write', write_table, table, os.path.join(directory, '%s.%s' % (name, fmt)), fmt)
+            if charts:
+                timed('charts', render_charts, tables, selected_user, df, directory)
+    except Exception:
+        return chat, timings, traceback.format_exc()
+    return chat, timings, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('exports', nargs='+', help="exported .txt files, or .zip files exported with media")
+    parser.add_argument('-o', '--out', required=True, help="output directory")
+    parser.add_argument('-a', '--analyses', default=','.join(DEFAULT_ANALYSES),
+                        help="comma separated analyses among %s, or 'all' (default: %%(default)s)" % ', '.join(ANALYSES))
+    parser.add_argument('-u', '--user', action='append',
+                        help="user to report on, may be repeated (default: Overall)")
+    parser.add_argument('-f', '--format', choices=FORMATS, default='json')
+    parser.add_argument('--charts', action='store_true', help="also render charts as PNG files")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1,
+                        help="worker processes, one chat each (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    analyses = list(ANALYSES) if args.analyses == 'all' else [name.strip() for name in args.analyses.split(',')]
+    unknown = [name for name in analyses if name not in ANALYSES]
+    if unknown:
+        parser.error("unknown analyses: %s" % ', '.join(unknown))
+    users = args.user or ['Overall']
+
+    jobs = [(path, analyses, users, args.out, args.format, args.charts) for path in args.exports]
+    start = time.perf_counter()
+    if args.workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.workers, len(jobs))) as pool:
+            results = list(pool.map(run_chat, *zip(*jobs)))
+    else:
+        results = [run_chat(*job) for job in jobs]
+
+    totals = defaultdict(float)
+    failed = 0
+    for chat, timings, error in results:
+        if error:
+            failed += 1
+            print("%s: failed\n%s" % (chat, error), file=sys.stderr)
+            continue
+        stages = ', '.join('%s %.2fs' % (stage, seconds) for stage, seconds in timings.items() if stage != 'messages')
+        print("%s: %d messages, %s" % (chat, timings['messages'], stages))
+        for stage, seconds in timings.items():
+            if stage != 'messages':
+                totals[stage] += seconds
+
+    print("total: %d chats in %.2fs, %s" % (len(results) - failed, time.perf_counter() - start,
+                                           ', '.join('%s %.2fs' % item for item in totals.items())))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""Runs the helper.py analyses of one chat concurrently.
+
+Light analyses run in a thread pool. CPU-bound ones (word cloud, topic models)
+run in worker processes that receive the parsed frame once, through the pool
+initializer, so tasks only send the name of the analysis and its arguments.
+A worker pool is kept per chat while runs use it, and reused by later runs.
+"""
+import os
+import time
+import inspect
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import (Future, ThreadPoolExecutor, ProcessPoolExecutor, CancelledError, wait,
+                                FIRST_COMPLETED)
+import cache
+import helper
+import profiling
+
+# Threads running the light analyses
+THREADS = 4
+# Worker processes of the CPU-bound analyses, processes are only used with 2 CPUs or more
+PROCESSES = min(4, os.cpu_count() or 1)
+
+# Frame of the chat held by a worker process
+_frame = None
+
+
+def _init_worker(df):
+    global _frame
+    _frame = df
+
+
+def _with_frame(func, args, df):
+    # Inserts the frame at the position of the `df` parameter of func
+    position = list(inspect.signature(func).parameters).index('df')
+    return args[:position] + (df,) + args[position:]
+
+
+def _run_in_worker(name, args, kwargs):
+    # args exclude the frame, it is the one given to _init_worker
+    func = getattr(helper, name)
+    return func(*_with_frame(func, args, _frame), **kwargs)
+
+
+# Idle worker pools kept for later runs of their chat, pools in use are never shut down
+IDLE_POOLS = 1
+
+_pool_lock = threading.Lock()
+# Chat fingerprint -> [pool, runs using it], least recently used first
+_pools = OrderedDict()
+
+
+def process_pool(df):
+    """Returns the process pool holding `df`, starting it when needed. Call release_pool(df) once done with it."""
+    key = cache.fingerprint(df)
+    with _pool_lock:
+        if key not in _pools:
+            # Spawned, not forked: forking while the analysis threads hold locks can deadlock the
+            # workers. The frame is pickled once per worker, never per task
+            _pools[key] = [ProcessPoolExecutor(max_workers=PROCESSES, mp_context=multiprocessing.get_context('spawn'),
+                                               initializer=_init_worker, initargs=(df,)), 0]
+        _pools.move_to_end(key)
+        _pools[key][1] += 1
+        return _pools[key][0]
+
+
+def release_pool(df):
+    """Ends a run using the pool of `df`, shutting down the idle pools past IDLE_POOLS."""
+    key = cache.fingerprint(df)
+    with _pool_lock:
+        if key in _pools:
+            _pools[key][1] -= 1
+        idle = [key for key, (_, runs) in _pools.items() if runs <= 0]
+        for key in idle[:max(len(idle) - IDLE_POOLS, 0)]:
+            pool, _ = _pools.pop(key)
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+class Task:
+    """One analysis: helper.<name>(*args, **kwargs) with the chat frame as its `df` argument."""
+
+    def __init__(self, name, args, kwargs, process):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.process = process
+        self.future = None
+        self.start = None
+        self.seconds = None
+
+    def finished(self, future):
+        self.seconds = time.perf_counter() - self.start
+
+
+class AnalysisScheduler:
+    """Submits the analyses of one chat and reports them as they finish.
+
+    Analyses are grouped in sections: a section is ready once all of its tasks
+    are, and `as_ready` yields sections in the order they become ready.
+    """
+
+    def __init__(self, df, threads=THREADS, processes=PROCESSES > 1):
+        self.df = df
+        self.threads = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='analysis')
+        self.processes = process_pool(df) if processes else None
+        self.released = False
+        self.sections = {}
+
+    def add(self, section, name, *args, process=False, **kwargs):
+        """Adds helper.<name>(*args, **kwargs) to `section`, the frame goes in as its `df` argument.
+
+        With `process`, the analysis runs in a worker process when there is more than one CPU.
+        """
+        self.sections.setdefault(section, []).append(Task(name, args, kwargs, process))
+
+    def _submit(self, task):
+        func = getattr(helper, task.name)
+        args = _with_frame(func, task.args, self.df)
+        task.start = time.perf_counter()
+        if not task.process or self.processes is None:
+            # Calls in the analysis threads are recorded into the run of the session
+            task.future = self.threads.submit(profiling.bind(func), *args, **task.kwargs)
+            return
+
+        # Results already known in this process are not computed again
+        key = func.cache_key(*args, **task.kwargs) if hasattr(func, 'cache_key') else None
+        found, value = cache.results.get(key) if key else (False, None)
+        profiling.note_cache(found)
+        task.future = Future()
+        if found:
+            task.future.set_result(value)
+            return
+        # Starting the workers of a new pool takes a while, the other tasks do not wait for it
+        threading.Thread(target=self._submit_to_process, args=(task, key), daemon=True).start()
+
+    def _submit_to_process(self, task, key):
+        def done(future):
+            if future.cancelled():
+                task.future.set_exception(CancelledError())
+                return
+            error = future.exception()
+            if error is not None:
+                task.future.set_exception(error)
+                return
+            # Later runs are served from the result cache of this process
+            if key:
+                cache.results.put(key, future.result())
+            task.future.set_result(future.result())
+
+        try:
+            self.processes.submit(_run_in_worker, task.name, task.args, task.kwargs).add_done_callback(done)
+        except Exception as error:
+            task.future.set_exception(error)
+
+    def start(self):
+        for tasks in self.sections.values():
+            for task in tasks:
+                self._submit(task)
+                task.future.add_done_callback(task.finished)
+
+    def as_ready(self):
+        """Yields (section, results, error) as sections finish, results in the order the tasks were added."""
+        pending = dict(self.sections)
+        try:
+            while pending:
+                futures = [task.future for tasks in pending.values() for task in tasks if not task.future.done()]
+                if futures:
+                    wait(futures, return_when=FIRST_COMPLETED)
+                for section in [section for section, tasks in pending.items()
+                                if all(task.future.done() for task in tasks)]:
+                    tasks = pending.pop(section)
+                    error = next((task.future.exception() for task in tasks if task.future.exception()), None)
+                    results = None if error else [task.future.result() for task in tasks]
+                    yield section, results, error
+        finally:
+            self.close()
+
+    def close(self):
+        """Stops the threads and hands the process pool back, done by as_ready once every section is out."""
+        self.threads.shutdown(wait=False, cancel_futures=True)
+        if self.processes is not None and not self.released:
+            self.released = True
+            release_pool(self.df)
+
+    def progress(self):
+        """Returns (finished tasks, all tasks)."""
+        tasks = [task for tasks in self.sections.values() for task in tasks]
+        return sum(task.future is not None and task.future.done() for task in tasks), len(tasks)
@@ -0,0 +1,223 @@
+"""Full-text search over the messages of a chat.
+
+An inverted index is built once per chat from the token table: every term
+(a run of word characters, lowercased) maps to the sorted ids of the text
+messages holding it, stored as variable-byte encoded gaps. Keyword queries
+intersect posting lists, rarest first. Phrases are checked on the term stream
+of the candidate messages only, and users and dates filter the hits through
+per-message arrays.
+
+Usage: python search.py CHAT.txt QUERY [--user NAME] [--start DATE] [--end DATE]
+"""
+import re
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+import cache
+import chat_index
+import preprocessor
+import text_stats
+
+# Terms of a message or a query: runs of word characters
+TERM = re.compile(r'\w+')
+# Quoted phrases and bare words of a query
+QUERY_PART = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def encode(values):
+    """Variable-byte encodes non-negative integers: 7 bits per byte, the high bit set on all but the last byte."""
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    ends = np.cumsum(lengths)
+    # Position of every byte in its value, least significant group first
+    shift = np.arange(int(ends[-1]) if len(ends) else 0) - np.repeat(ends - lengths, lengths)
+    data = ((np.repeat(values, lengths) >> (np.uint64(7) * shift.astype(np.uint64))) & np.uint64(127)).astype(np.uint8)
+    data[shift < np.repeat(lengths, lengths) - 1] |= 128
+    return data
+
+
+def decode(data):
+    """Returns the integers variable-byte encoded in `data`."""
+    data = np.asarray(data, dtype=np.uint8)
+    if len(data) == 0:
+        return np.array([], dtype=np.int64)
+    last = data < 128
+    starts = np.concatenate(([0], np.flatnonzero(last)[:-1] + 1))
+    shift = np.arange(len(data)) - starts[np.cumsum(last) - last]
+    groups = (data & 127).astype(np.int64) << (7 * shift)
+    return np.add.reduceat(groups, starts)
+
+
+def parse_query(query):
+    """Returns the phrases of `query` as lists of terms.
+
+    Quoted text is one phrase, every other word is a phrase of its own terms
+    (e.g. "don't" is the phrase don t). Words without a term, like emojis, are left out.
+    """
+    phrases = []
+    for quoted, word in QUERY_PART.findall(query):
+        terms = TERM.findall((quoted or word).lower())
+        if terms:
+            phrases.append(terms)
+    return phrases
+
+
+def _ranges(starts, ends):
+    # Concatenation of the ranges [start, end)
+    lengths = ends - starts
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+
+
+class SearchIndex:
+    """Inverted index of the text messages of a chat (no notifications or media rows).
+
+    `postings` holds the message id gaps of every term back to back, the ones of
+    term t between `offsets[t]` and `offsets[t + 1]`. The term stream (`stream`,
+    one term id per occurrence, message after message) answers phrase queries.
+    `user_codes` and `timestamps` give the user and date of every message.
+    """
+
+    def __init__(self, df):
+        tokens = text_stats.get_tokens(df)
+
+        # Terms of every word of the vocabulary, as a CSR word -> terms mapping
+        term_lookup = {}
+        word_terms = []
+        terms_per_word = np.zeros(len(tokens.vocab), dtype=np.int64)
+        for word_id, word in enumerate(tokens.vocab):
+            terms = TERM.findall(word)
+            terms_per_word[word_id] = len(terms)
+            word_terms.extend(term_lookup.setdefault(term, len(term_lookup)) for term in terms)
+        word_terms = np.array(word_terms, dtype=np.int64)
+        word_starts = np.cumsum(terms_per_word) - terms_per_word
+        self.term_lookup = term_lookup
+
+        # Term stream of the text messages, in message order
+        is_text = np.zeros(len(df), dtype=bool)
+        is_text[chat_index.get_index(df).text] = True
+        kept = is_text[tokens.message_ids]
+        token_ids = tokens.token_ids[kept]
+        occurrences = _ranges(word_starts[token_ids], word_starts[token_ids] + terms_per_word[token_ids])
+        term_ids = word_terms[occurrences]
+        message_ids = np.repeat(tokens.message_ids[kept], terms_per_word[token_ids])
+        self.stream = term_ids.astype(np.uint16 if len(term_lookup) <= np.iinfo(np.uint16).max else np.int32)
+        self.message_starts = np.searchsorted(message_ids, np.arange(len(df) + 1))
+
+        # Posting lists: the distinct (term, message) pairs sorted by term, as gaps per term
+        pairs = np.unique(term_ids * len(df) + message_ids)
+        pair_terms, pair_messages = np.divmod(pairs, max(len(df), 1))
+        self.frequency = np.bincount(pair_terms, minlength=len(term_lookup))
+        first = np.r_[True, pair_terms[1:] != pair_terms[:-1]]
+        gaps = pair_messages - np.where(first, 0, np.r_[0, pair_messages[:-1]])
+        self.postings = encode(gaps)
+        # Every gap ends with a byte below 128, the lists split after the last gap of each term
+        gap_ends = np.r_[0, np.flatnonzero(self.postings < 128) + 1]
+        self.offsets = np.r_[0, gap_ends[np.cumsum(self.frequency)]]
+
+        users = df['user'].astype('category')
+        self.users = list(users.cat.categories)
+        self.user_lookup = {user: code for code, user in enumerate(self.users)}
+        self.user_codes = users.cat.codes.to_numpy()
+        self.timestamps = df['date'].to_numpy().astype('datetime64[s]')
+
+    def messages(self, term):
+        """Returns the sorted ids of the messages holding `term`."""
+        term_id = self.term_lookup.get(term)
+        if term_id is None:
+            return np.array([], dtype=np.int64)
+        return np.cumsum(decode(self.postings[self.offsets[term_id]:self.offsets[term_id + 1]]))
+
+    def _phrase(self, terms):
+        # Messages holding every term, rarest term first so the intersections stay small
+        if any(term not in self.term_lookup for term in terms):
+            return np.array([], dtype=np.int64)
+        term_ids = [self.term_lookup[term] for term in terms]
+        found = None
+        for term in sorted(set(terms), key=lambda term: self.frequency[self.term_lookup[term]]):
+            found = self.messages(term) if found is None else np.intersect1d(found, self.messages(term),
+                                                                           assume_unique=True)
+            if len(found) == 0:
+                return found
+        if len(terms) == 1:
+            return found
+
+        # The terms in a row: from every occurrence of the first one, within the same message
+        starts, ends = self.message_starts[found], self.message_starts[found + 1]
+        positions = _ranges(starts, ends)
+        message_ends = np.repeat(ends, ends - starts)
+        matched = (self.stream[positions] == term_ids[0]) & (positions + len(terms) <= message_ends)
+        positions, message_ends = positions[matched], message_ends[matched]
+        for offset, term_id in enumerate(term_ids[1:], 1):
+            matched = self.stream[positions + offset] == term_id
+            positions, message_ends = positions[matched], message_ends[matched]
+        return np.unique(np.searchsorted(self.message_starts, positions, side='right') - 1)
+
+    def search(self, query, selected_user='Overall', start=None, end=None):
+        """Returns the sorted ids of the messages matching every phrase of `query`.
+
+        Hits are limited to `selected_user` ('Overall' for everyone) and to dates
+        from `start` up to `end` excluded, both optional.
+        """
+        phrases = parse_query(query)
+        if not phrases:
+            return np.array([], dtype=np.int64)
+        found = None
+        for terms in phrases:
+            matches = self._phrase(terms)
+            found = matches if found is None else np.intersect1d(found, matches, assume_unique=True)
+            if len(found) == 0:
+                return found
+
+        if selected_user != 'Overall':
+            code = self.user_lookup.get(selected_user, -1)
+            found = found[self.user_codes[found] == code]
+        if start is not None:
+            found = found[self.timestamps[found] >= pd.Timestamp(start).to_datetime64().astype('datetime64[s]')]
+        if end is not None:
+            found = found[self.timestamps[found] < pd.Timestamp(end).to_datetime64().astype('datetime64[s]')]
+        return found
+
+    def timeline(self, ids):
+        """Returns the hits per month of the messages `ids`, with the columns of helper.monthly_timeline."""
+        months = self.timestamps[ids].astype('datetime64[M]')
+        months, counts = np.unique(months[~np.isnat(months)].view(np.int64), return_counts=True)
+        year, month_num = 1970 + months // 12, months % 12 + 1
+        month = [preprocessor.MONTHS[i - 1] for i in month_num]
+        return pd.DataFrame({'year': year, 'month_num': month_num, 'month': month, 'message': counts,
+                             'time': [name + "-" + str(y) for name, y in zip(month, year)]})
+
+    def nbytes(self):
+        """Returns the bytes taken by the postings, term stream and per-message arrays."""
+        return int(self.postings.nbytes + self.offsets.nbytes + self.frequency.nbytes + self.stream.nbytes
+                   + self.message_starts.nbytes + self.user_codes.nbytes + self.timestamps.nbytes)
+
+
+def get_search_index(df):
+    """Returns the SearchIndex of `df`, building it on first use."""
+    return cache.per_chat(df, 'search', SearchIndex)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search the messages of an exported chat.")
+    parser.add_argument('chat', help="exported .txt file")
+    parser.add_argument('query', help='words and "quoted phrases", all of them must match')
+    parser.add_argument('--user', default='Overall')
+    parser.add_argument('--start', help="first date, e.g. 2023-01-01")
+    parser.add_argument('--end', help="date after the last one")
+    parser.add_argument('--limit', type=int, default=20, help="messages printed at most")
+    args = parser.parse_args(argv)
+
+    df = preprocessor.preprocess(args.chat)
+    ids = get_search_index(df).search(args.query, args.user, args.start, args.end)
+    print("%d messages" % len(ids))
+    for date, user, message in df.iloc[ids[-args.limit:]][['date', 'user', 'message']].itertuples(index=False):
+        print("%s  %s: %s" % (date, user, message))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import cache
+
+# Scores above THRESHOLDS[backend] are positive, below its opposite negative.
+# TextBlob polarity and the VADER compound score both range from -1 to 1.
+THRESHOLDS = {'textblob': 0.1, 'vader': 0.05}
+BACKENDS = tuple(THRESHOLDS)
+
+# Number of distinct texts scored by one task of the process pool
+BATCH_SIZE = 5000
+# Below this many distinct texts starting worker processes costs more than it saves
+PARALLEL_MIN_TEXTS = 20000
+
+# Scorers are created once per process, on first use
+_scorers = {}
+
+
+def _scorer(backend):
+    if backend not in _scorers:
+        if backend == 'textblob':
+            from textblob import TextBlob
+            _scorers[backend] = lambda text: TextBlob(text).sentiment.polarity
+        elif backend == 'vader':
+            from nltk.sentiment.vader import SentimentIntensityAnalyzer
+            try:
+                analyzer = SentimentIntensityAnalyzer()
+            except LookupError:
+                # The lexicon is looked up in the local NLTK data only, never downloaded
+                raise LookupError("The VADER lexicon is not installed, "
+                                  "run: python -m nltk.downloader vader_lexicon") from None
+            _scorers[backend] = lambda text: analyzer.polarity_scores(text)['compound']
+        else:
+            raise ValueError("Unknown sentiment backend %r, expected one of %s" % (backend, ', '.join(BACKENDS)))
+    return _scorers[backend]
+
+
+def _score_batch(backend, texts):
+    score = _scorer(backend)
+    return np.array([score(text) for text in texts], dtype=np.float64)
+
+
+def score_texts(texts, backend='textblob', workers=None):
+    """Returns the polarity of each text, from -1 (negative) to 1 (positive).
+
+    Every distinct text is scored once. Large inputs are split in batches over a
+    pool of `workers` processes (all CPUs by default, 1 to stay in this process).
+    """
+    _scorer(backend)
+    codes, unique = pd.factorize(pd.Series(texts, dtype=object))
+    unique = list(unique)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers > 1 and len(unique) >= PARALLEL_MIN_TEXTS:
+        batches = [unique[start:start + BATCH_SIZE] for start in range(0, len(unique), BATCH_SIZE)]
+        # Spawned, not forked: the app scores from an analysis thread while other threads hold locks,
+        # like the workers of scheduler.process_pool
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            scores = np.concatenate(list(pool.map(_score_batch, [backend] * len(batches), batches)))
+    else:
+        scores = _score_batch(backend, unique)
+
+    return scores[codes] if len(scores) else np.zeros(len(codes), dtype=np.float64)
+
+
+def label(scores, backend='textblob'):
+    """Returns 'Positive', 'Negative' or 'Neutral' for each score."""
+    threshold = THRESHOLDS[backend]
+    return np.where(scores > threshold, 'Positive', np.where(scores < -threshold, 'Negative', 'Neutral'))
+
+
+def get_scores(df, backend='textblob', workers=None):
+    """Returns the polarity of every message of `df`, scored once per chat and backend."""
+    return cache.per_chat(df, 'sentiment-' + backend, lambda df: score_texts(df['message'], backend, workers))
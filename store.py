@@ -0,0 +1,186 @@
+"""Local store of parsed chats, kept as Parquet files partitioned by chat and year.
+
+Only the parsed columns (date, user, message) are stored, the calendar columns are
+derived again on load. Within a year rows are sorted by user, so a user filter
+skips the row groups of the other users and a date range skips whole years.
+Loaded frames have the shape returned by preprocessor.preprocess and can be passed
+to the helper.py analyses.
+
+Usage: python store.py ingest STORE_DIR EXPORT_DIR
+       python store.py list STORE_DIR
+"""
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import functools
+import operator
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import preprocessor
+import cache
+
+CATALOG = 'catalog.json'
+# Rows per Parquet row group, the unit skipped by the user filter
+ROW_GROUP_SIZE = 16384
+
+
+def chat_name(path):
+    """Returns the store name of the export at `path`: its file name without extension."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', stem).strip('_') or 'chat'
+
+
+class ChatStore:
+    """Parsed chats stored under `root`, one `chat=<name>/year=<year>` directory per partition."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.catalog = self._read_catalog()
+
+    def _read_catalog(self):
+        path = os.path.join(self.root, CATALOG)
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_catalog(self):
+        path = os.path.join(self.root, CATALOG)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.catalog, f, indent=1, sort_keys=True)
+        os.replace(path + '.tmp', path)
+
+    def _chat_dir(self, chat):
+        return os.path.join(self.root, 'chat=' + chat)
+
+    def chats(self):
+        return sorted(self.catalog)
+
+    def users(self, chat):
+        return self.catalog[chat]['users']
+
+    def ingest(self, chat, data):
+        """Parses the export `data` and stores it as `chat`, replacing an older version.
+
+        Returns False when the same export is already stored.
+        """
+        key = cache.content_key(data)
+        if self.catalog.get(chat, {}).get('key') == key:
+            return False
+
+        df = preprocessor.preprocess(data)
+        table = pd.DataFrame({
+            'seq': np.arange(len(df), dtype=np.int64),
+            'date': df['date'],
+            'user': df['user'].astype(object),
+            'message': df['message'],
+            'year': preprocessor.calendar_column(df, 'year'),
+        }).sort_values(['year', 'user', 'seq'])
+
+        # Written next to the old version and swapped in once complete
+        target = self._chat_dir(chat)
+        staging = target + '.tmp'
+        shutil.rmtree(staging, ignore_errors=True)
+        pq.write_to_dataset(pa.Table.from_pandas(table, preserve_index=False), staging,
+                            partition_cols=['year'], row_group_size=ROW_GROUP_SIZE)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(staging, target)
+
+        self.catalog[chat] = {
+            'key': key,
+            'messages': len(df),
+            'users': sorted(user for user in df['user'].unique() if user != 'group_notification'),
+            'first': str(df['date'].min()) if len(df) else None,
+            'last': str(df['date'].max()) if len(df) else None,
+            'layout': df.attrs['parse_stats']['layout'],
+        }
+        self._write_catalog()
+        return True
+
+    def remove(self, chat):
+        shutil.rmtree(self._chat_dir(chat), ignore_errors=True)
+        self.catalog.pop(chat, None)
+        self._write_catalog()
+
+    def load(self, chat, user=None, start=None, end=None):
+        """Returns the messages of `chat`, optionally of one `user` and from `start` to `end` (excluded).
+
+        The filters are applied while reading: years outside the range are not
+        opened and row groups without the user are skipped. A frame of one user
+        has no replies from the others, so response times need the whole chat.
+        """
+        if chat not in self.catalog:
+            raise KeyError("Unknown chat %r" % chat)
+
+        conditions = []
+        if user is not None and user != 'Overall':
+            conditions.append(ds.field('user') == user)
+        if start is not None:
+            start = pd.Timestamp(start)
+            conditions += [ds.field('year') >= start.year, ds.field('date') >= start]
+        if end is not None:
+            end = pd.Timestamp(end)
+            conditions += [ds.field('year') <= end.year, ds.field('date') < end]
+
+        dataset = ds.dataset(self._chat_dir(chat), format='parquet', partitioning='hive')
+        table = dataset.to_table(columns=['seq', 'date', 'user', 'message'],
+                                 filter=functools.reduce(operator.and_, conditions) if conditions else None)
+
+        df = table.to_pandas().sort_values('seq', ignore_index=True).drop(columns='seq')
+        df['user'] = df['user'].astype(str).astype('category')
+        df['message'] = df['message'].astype(object)
+        df = preprocessor.add_derived_columns(df)
+
+        # Same selection of the same export, same analyses
+        selection = repr((self.catalog[chat]['key'], user, start, end)).encode()
+        cache.stamp(df, hashlib.blake2b(selection, digest_size=16).hexdigest())
+        return df
+
+
+def ingest_directory(store, directory):
+    """Ingests every .txt export found under `directory`, yielding (path, chat, stored)."""
+    for folder, _, files in sorted(os.walk(directory)):
+        for name in sorted(files):
+            if not name.lower().endswith('.txt'):
+                continue
+            path = os.path.join(folder, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            chat = chat_name(path)
+            yield path, chat, store.ingest(chat, data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest = commands.add_parser('ingest', help="parse and store every .txt export of a directory")
+    ingest.add_argument('store_dir')
+    ingest.add_argument('export_dir')
+    listing = commands.add_parser('list', help="list the stored chats")
+    listing.add_argument('store_dir')
+    args = parser.parse_args(argv)
+
+    store = ChatStore(args.store_dir)
+    if args.command == 'ingest':
+        for path, chat, stored in ingest_directory(store, args.export_dir):
+            if stored:
+                print("%s: stored as %s, %d messages" % (path, chat, store.catalog[chat]['messages']))
+            else:
+                print("%s: %s is up to date" % (path, chat))
+    else:
+        for chat in store.chats():
+            entry = store.catalog[chat]
+            print("%s: %d messages, %d users, %s to %s"
+                  % (chat, entry['messages'], len(entry['users']), entry['first'], entry['last']))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
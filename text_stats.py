@@ -0,0 +1,92 @@
+import os
+import string
+import numpy as np
+import pandas as pd
+import cache
+import chat_index
+
+
+
+def _load_stopwords():
+    words = set()
+    # stop_english.txt is NLTK's English list, bundled so that neither nltk nor its
+    # downloader is needed
+    for name in ('stop_english.txt', 'stop_hinglish.txt'):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+        with open(path, encoding='utf-8') as f:
+            words.update(line.strip().lower() for line in f if line.strip())
+    return frozenset(words)
+
+
+# English and Hinglish stop words, loaded once
+STOPWORDS = _load_stopwords()
+PUNCTUATION = frozenset(string.punctuation)
+# Tokens of the "<Media omitted>" placeholder
+MEDIA_TOKENS = frozenset(['<media', 'omitted>'])
+# Extra words left out of topic modeling, see topics.DocumentTerms
+TOPIC_STOPWORDS = STOPWORDS | frozenset(['media', 'omitted', 'deleted', 'this', 'that', 'with', 'from', 'for'])
+
+
+class TokenTable:
+    """Every whitespace token of a chat, tokenized once.
+
+    The table has one row per token: `message_ids` (row position of the message),
+    `token_ids` (position in `vocab`) and `user_ids` (position in `users`). Tokens
+    are lowercased. Counts per user are vectorized group-bys over these arrays.
+    """
+
+    def __init__(self, df):
+        tokens = [message.lower().split() for message in df['message']]
+        self.words_per_message = np.fromiter((len(words) for words in tokens), dtype=np.int32, count=len(tokens))
+
+        flat = np.empty(int(self.words_per_message.sum()), dtype=object)
+        start = 0
+        for words in tokens:
+            flat[start:start + len(words)] = words
+            start += len(words)
+        del tokens
+
+        token_ids, self.vocab = pd.factorize(flat)
+        self.token_ids = token_ids.astype(np.int32)
+        self.message_ids = np.repeat(np.arange(len(df), dtype=np.int32), self.words_per_message)
+
+        user_ids, self.users = pd.factorize(df['user'].to_numpy(dtype=object))
+        self.user_ids = user_ids.astype(np.int32)[self.message_ids]
+        self.user_lookup = {user: user_id for user_id, user in enumerate(self.users)}
+
+        # Tokens of text messages (no notification or media) that are not stop words
+        self.is_stopword = np.fromiter((word in STOPWORDS or word in MEDIA_TOKENS for word in self.vocab),
+                                       dtype=bool, count=len(self.vocab))
+        is_text = np.zeros(len(df), dtype=bool)
+        is_text[chat_index.get_index(df).text] = True
+        self.counted = is_text[self.message_ids] & ~self.is_stopword[self.token_ids]
+        self._word_counts = None
+
+    def user_word_counts(self):
+        """Returns the counts of non stop words in text messages per (user id, token id)."""
+        if self._word_counts is None:
+            counted = pd.DataFrame({'user': self.user_ids[self.counted], 'token': self.token_ids[self.counted]})
+            self._word_counts = counted.groupby(['user', 'token']).size()
+        return self._word_counts
+
+    def word_counts(self, selected_user):
+        """Returns the counts of non stop words in text messages, most common first."""
+        counts = self.user_word_counts()
+        if selected_user == 'Overall':
+            counts = counts.groupby(level='token').sum()
+        else:
+            try:
+                counts = counts.xs(self.user_lookup[selected_user], level='user')
+            except KeyError:
+                return pd.Series([], dtype=np.int64)
+        # Stable sort keeps words with equal counts in order of first appearance
+        counts = counts.sort_values(ascending=False, kind='stable')
+        return pd.Series(counts.to_numpy(), index=self.vocab[counts.index.to_numpy()])
+
+    def total_words(self, positions):
+        return int(self.words_per_message[positions].sum())
+
+
+def get_tokens(df):
+    """Returns the TokenTable of `df`, building it on first use."""
+    return cache.per_chat(df, 'tokens', TokenTable)
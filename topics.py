@@ -0,0 +1,166 @@
+import re
+import numpy as np
+import pandas as pd
+import cache
+import chat_index
+import text_stats
+
+# Terms as TfidfVectorizer finds them in a whitespace token: 2 or more word characters
+TERM = re.compile(r'(?u)\b\w\w+\b')
+# Terms kept in a selection: in at least MIN_DF messages and at most MAX_DF of them
+MIN_DF = 2
+MAX_DF = 0.95
+METHODS = ('lda', 'nmf')
+# Messages fitted at most, larger selections are sampled
+SAMPLE_SIZE = 20000
+# Messages per minibatch of the online fits
+BATCH_SIZE = 2048
+
+
+class DocumentTerms:
+    """Term counts of every message of a chat, as a CSR matrix with one row per message.
+
+    Built once per chat from the token table: stop words and words shorter than 3
+    characters are left out, the remaining tokens are split into terms like
+    TfidfVectorizer does. Notification and media rows are empty. Users and time
+    windows are row slices of it.
+    """
+
+    def __init__(self, df):
+        # scipy is only loaded once topics are asked for
+        from scipy import sparse
+        tokens = text_stats.get_tokens(df)
+        stopwords = text_stats.TOPIC_STOPWORDS
+        keep = (~np.fromiter((word in stopwords or len(word) < 3 for word in tokens.vocab),
+                             dtype=bool, count=len(tokens.vocab)))
+
+        # Word to term matrix: the terms found in every kept word of the vocabulary
+        term_ids = {}
+        words, terms = [], []
+        for word_id in np.flatnonzero(keep):
+            for term in TERM.findall(tokens.vocab[word_id]):
+                words.append(word_id)
+                terms.append(term_ids.setdefault(term, len(term_ids)))
+        word_terms = sparse.csr_matrix((np.ones(len(words), dtype=np.int32), (words, terms)),
+                                       shape=(len(tokens.vocab), len(term_ids)))
+
+        # Text messages only, like ChatIndex.user_positions(messages_only=True)
+        is_text = np.zeros(len(df), dtype=bool)
+        is_text[chat_index.get_index(df).text] = True
+        counted = is_text[tokens.message_ids] & keep[tokens.token_ids]
+        message_words = sparse.csr_matrix((np.ones(int(counted.sum()), dtype=np.int32),
+                                           (tokens.message_ids[counted], tokens.token_ids[counted])),
+                                          shape=(len(df), len(tokens.vocab)))
+        self.matrix = (message_words @ word_terms).tocsr()
+        self.terms = np.array(sorted(term_ids, key=term_ids.get), dtype=object)
+
+    def select(self, positions, min_df=MIN_DF, max_df=MAX_DF):
+        """Returns (counts, terms) of the messages at `positions`, without too rare or too common terms."""
+        counts = self.matrix[positions]
+        document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+        columns = np.flatnonzero((document_frequency >= min_df) & (document_frequency <= max_df * len(positions)))
+        return counts[:, columns], self.terms[columns]
+
+
+def get_document_terms(df):
+    """Returns the DocumentTerms of `df`, building it on first use."""
+    return cache.per_chat(df, 'document_terms', DocumentTerms)
+
+
+def _model(method, n_topics, iterations, random_state, first_batch=None):
+    # NMF starts from an SVD of the first batch, which needs as many rows and terms as topics
+    if method == 'nmf' and first_batch is not None and n_topics > min(first_batch.shape):
+        init = 'random'
+    else:
+        init = 'nndsvda'
+    if method == 'lda':
+        from sklearn.decomposition import LatentDirichletAllocation
+        return LatentDirichletAllocation(n_components=n_topics, learning_method='online', batch_size=BATCH_SIZE,
+                                         max_iter=iterations, random_state=random_state)
+    if method == 'nmf':
+        from sklearn.decomposition import MiniBatchNMF
+        return MiniBatchNMF(n_components=n_topics, batch_size=BATCH_SIZE, max_iter=iterations,
+                            init=init, random_state=random_state)
+    raise ValueError("Unknown topic method %r, expected one of %s" % (method, ', '.join(METHODS)))
+
+
+def _weights(counts, method):
+    # LDA models term counts, NMF works best on TF-IDF weights
+    if method == 'nmf':
+        from sklearn.feature_extraction.text import TfidfTransformer
+        return TfidfTransformer().fit_transform(counts)
+    return counts
+
+
+def top_terms(model, terms, n_words=5):
+    """Returns [{'topic_id', 'words'}] with the `n_words` heaviest terms of every topic."""
+    return [{'topic_id': topic_id, 'words': [terms[i] for i in topic.argsort()[:-n_words - 1:-1]]}
+            for topic_id, topic in enumerate(model.components_)]
+
+
+def fit_topics(positions, df, n_topics=5, method='lda', iterations=5, sample_size=SAMPLE_SIZE,
+               n_words=5, random_state=42):
+    """Fits a topic model on the messages at `positions` and returns (topics, model).
+
+    Selections larger than `sample_size` messages are fitted on a random sample of
+    them. Returns ([], None) when no term is left to model.
+    """
+    if sample_size and len(positions) > sample_size:
+        rng = np.random.default_rng(random_state)
+        positions = np.sort(rng.choice(positions, sample_size, replace=False))
+    counts, terms = get_document_terms(df).select(positions)
+    # Messages without a kept term carry nothing to fit
+    counts = counts[counts.getnnz(axis=1) > 0]
+    if counts.shape[1] == 0 or counts.shape[0] == 0:
+        return [], None
+
+    # No more NMF topics than messages or terms
+    if method == 'nmf':
+        n_topics = min(n_topics, *counts.shape)
+    model = _model(method, n_topics, iterations, random_state)
+    model.fit(_weights(counts, method))
+    return top_terms(model, terms, n_words), model
+
+
+def topics_over_time(positions, df, window='Q', n_topics=5, method='lda', iterations=1, sample_size=SAMPLE_SIZE,
+                     n_words=5, random_state=42):
+    """Returns the topics after every time window of the messages at `positions`.
+
+    One model is updated window after window with partial_fit, so topics keep their
+    ids and drift as the chat goes on. `window` is a pandas period ('M', 'Q', 'Y').
+    The frame has the columns window, topic_id, words and messages.
+    """
+    counts, terms = get_document_terms(df).select(positions)
+    if counts.shape[1] == 0 or len(positions) == 0:
+        return pd.DataFrame(columns=['window', 'topic_id', 'words', 'messages'])
+
+    # Weighted once for the whole selection, so every window shares the same terms
+    weights = _weights(counts, method).tocsr()
+    periods = df['date'].to_numpy()[positions].astype('datetime64[ns]')
+    windows = pd.PeriodIndex(pd.DatetimeIndex(periods), freq=window)
+    # No more NMF topics than terms, the model is made once the first window is known
+    if method == 'nmf':
+        n_topics = min(n_topics, counts.shape[1])
+    model = None
+    rng = np.random.default_rng(random_state)
+
+    rows = []
+    codes, labels = pd.factorize(windows, sort=True)
+    for code, label in enumerate(labels):
+        selected = np.flatnonzero(codes == code)
+        messages = len(selected)
+        if sample_size and len(selected) > sample_size:
+            selected = np.sort(rng.choice(selected, sample_size, replace=False))
+        batch = weights[selected]
+        batch = batch[batch.getnnz(axis=1) > 0]
+        if batch.shape[0] == 0:
+            continue
+        if model is None:
+            model = _model(method, n_topics, iterations, random_state, batch[:BATCH_SIZE])
+        for _ in range(iterations):
+            for start in range(0, batch.shape[0], BATCH_SIZE):
+                model.partial_fit(batch[start:start + BATCH_SIZE])
+        for topic in top_terms(model, terms, n_words):
+            rows.append({'window': str(label), 'topic_id': topic['topic_id'], 'words': topic['words'],
+                         'messages': messages})
+    return pd.DataFrame(rows, columns=['window', 'topic_id', 'words', 'messages'])